@@ -1,9 +1,9 @@
 from numpy import NaN, Inf
-from .mds import rdmds, wrmds
+from .mds import rdmds, wrmds, iter_rdmds
 from .ptracers import iolabel,iolabel2num
 from .diagnostics import readstats
 from .mnc import rdmnc, mnc_files
 
-__all__ = ['NaN', 'Inf', 'rdmds', 'wrmds', 'iolabel', 'iolabel2num',
+__all__ = ['NaN', 'Inf', 'rdmds', 'wrmds', 'iter_rdmds', 'iolabel', 'iolabel2num',
            'readstats', 'rdmnc', 'mnc_files', 'cs', 'llc']
 
@@ -139,70 +139,66 @@ def contour(*arguments, **kwargs):
     return h
 
 def flat(fld, **kwargs):
-    """convert mds data into global 2D field
-    only fields with 2 to 5 dimensions are allowed"""
+    """convert mds data into global 2D field;
+    the conversion applies to the last two dimensions of fields with
+    2 or more dimensions"""
 
     ndims = len(fld.shape)
-    if ndims == 2:
-        gfld = _flat2D(fld, **kwargs)
-    elif ndims == 3:
-        gfld = [ _flat2D(fld[a,:,:], **kwargs)
-                 for a in range(fld.shape[0]) ]
-    elif ndims == 4:
-        gfld = [ [ _flat2D(fld[a,b,:,:], **kwargs)
-                   for b in range(fld.shape[1]) ]
-                 for a in range(fld.shape[0]) ]
-    elif ndims == 5:
-        gfld = [ [ [ _flat2D(fld[a,b,c,:,:], **kwargs)
-                     for c in range(fld.shape[2]) ]
-                   for b in range(fld.shape[1]) ]
-                 for a in range(fld.shape[0]) ]
-    else:
+    if ndims < 2:
         print("wrong number of dimensions")
-        print("only 2 to 5 dimensions are allowed")
+        print("only 2 or more dimensions are allowed")
         sys.exit(__doc__)
 
-    gfld = np.array(gfld)
+    gfld = _flat2D(fld, **kwargs)
 
     return gfld
 
+def _transpose(fld):
+    """transpose the last two dimensions"""
+    return np.swapaxes(fld, -1, -2)
+
 def _flat2D(fld, center='Atlantic'):
-    """convert mds 2D data into global 2D field"""
+    """convert mds 2D data into global 2D field
+    (along the last two dimensions)"""
 
-    nx = fld.shape[1]
-    ny = fld.shape[0]
+    nx = fld.shape[-1]
+    ny = fld.shape[-2]
     n = ny//nx//4
+    lead = fld.shape[:-2]
 
     # eastern and western hemispheres
-    eastern=np.concatenate((fld[:n*nx,:],fld[n*nx:2*(n*nx)]),axis=1)
-    tmp    = fld[2*(n*nx)+nx:,        ::-1]
-    western=np.concatenate((tmp[2::n,:].transpose(),
-                            tmp[1::n,:].transpose(),
-                            tmp[0::n,:].transpose()))
+    eastern=np.concatenate((fld[...,:n*nx,:],fld[...,n*nx:2*(n*nx),:]),axis=-1)
+    tmp    = fld[...,2*(n*nx)+nx:,        ::-1]
+    western=np.concatenate((_transpose(tmp[...,2::n,:]),
+                            _transpose(tmp[...,1::n,:]),
+                            _transpose(tmp[...,0::n,:])),axis=-2)
     # Arctic face is special
-    arctic  = fld[2*(n*nx):2*(n*nx)+nx,:]
-    arctice = np.concatenate((np.triu(arctic[::-1,:nx//2].transpose()),
-                              np.zeros((nx//2,nx))),axis=1)
+    arctic  = fld[...,2*(n*nx):2*(n*nx)+nx,:]
+    arctice = np.concatenate((np.triu(_transpose(arctic[...,::-1,:nx//2])),
+                              np.zeros(lead+(nx//2,nx),fld.dtype)),axis=-1)
     # arcticw = np.concatenate((arctic[:,nx:nx//2-1:-1].transpose(),
     #                           np.zeros((nx//2,nx//2)),
     #                           arctic[nx:nx//2-1:-1,nx//2-1::-1]),axis=1)
-    mskr = np.tri(nx//2)[::-1,:]
-    arcticw = np.concatenate((arctic[0:nx//2,nx:nx//2-1:-1].transpose(),
-                              arctic[nx//2:nx,nx:nx//2-1:-1].transpose()*mskr,
-                              np.triu(arctic[nx:nx//2-1:-1,nx:nx//2-1:-1]),
-                              arctic[nx:nx//2-1:-1,nx//2-1::-1]*mskr),axis=1)
+    mskr = np.tri(nx//2,dtype=fld.dtype)[::-1,:]
+    arcticw = np.concatenate((_transpose(arctic[...,0:nx//2,nx:nx//2-1:-1]),
+                              _transpose(arctic[...,nx//2:nx,nx:nx//2-1:-1])*mskr,
+                              np.triu(arctic[...,nx:nx//2-1:-1,nx:nx//2-1:-1]),
+                              arctic[...,nx:nx//2-1:-1,nx//2-1::-1]*mskr),axis=-1)
     #
     if center == 'Pacific':
-        gfld = np.concatenate( ( np.concatenate((eastern,arctice)),
-                                 np.concatenate((western,arcticw)) ), axis=1)
+        gfld = np.concatenate( ( np.concatenate((eastern,arctice),axis=-2),
+                                 np.concatenate((western,arcticw),axis=-2) ),
+                               axis=-1)
     else:
-        gfld = np.concatenate( ( np.concatenate((western,arcticw)),
-                                 np.concatenate((eastern,arctice)) ), axis=1)
+        gfld = np.concatenate( ( np.concatenate((western,arcticw),axis=-2),
+                                 np.concatenate((eastern,arctice),axis=-2) ),
+                               axis=-1)
 
     return gfld
 
 def _mds2D(fld,center='Atlantic'):
-    """convert global 2D 'flat field' to mds 2D data"""
+    """convert global 2D 'flat field' to mds 2D data
+    (along the last two dimensions)"""
 
     ni = fld.shape[-1]
     nj = fld.shape[-2]
@@ -210,99 +206,48 @@ def _mds2D(fld,center='Atlantic'):
     ny = nx*(3*4+1)
     n = ny//nx//4
 
+    if center == 'Pacific':
+        # eastern hemisphere is on the left
+        fld = np.concatenate((fld[...,2*nx:],fld[...,:2*nx]),axis=-1)
+
     # arctic face
-    arcticw = fld[n*nx:,:nx]
-    arctice = fld[n*nx:,2*nx:3*nx]
-    arctic = np.concatenate((arctice,arcticw[::-1,::-1]),axis=0)
+    arcticw = fld[...,n*nx:,:nx]
+    arctice = fld[...,n*nx:,2*nx:3*nx]
+    arctic = np.concatenate((arctice,arcticw[...,::-1,::-1]),axis=-2)
 
     # eastern and western hemispheres
-    eastern=fld[:n*nx,2*nx:]
+    eastern=fld[...,:n*nx,2*nx:]
     # this is tricky
-    western=fld[:n*nx,:2*nx]
-
-    mdsfld = np.concatenate((eastern[:,:nx],
-                             eastern[:,nx:],
-                             arctic[:,::-1].transpose(),
-                             western[::-1,:].transpose().reshape((2*n*nx,nx))),
-                             axis=0)
+    western=fld[...,:n*nx,:2*nx]
+
+    mdsfld = np.concatenate((eastern[...,:nx],
+                             eastern[...,nx:],
+                             _transpose(arctic[...,::-1]),
+                             _transpose(western[...,::-1,:]).reshape(
+                                 fld.shape[:-2]+(2*n*nx,nx))),
+                             axis=-2)
     return mdsfld
 
 def mds(fld,center='Atlantic'):
     """convert global 'flat' field into mds data;
-    only fields with 2 to 5 dimensions are allowed"""
+    the conversion applies to the last two dimensions of fields with
+    2 or more dimensions"""
 
     ndims = len(fld.shape)
-    if ndims == 2:
-        mdsfld = _mds2D(fld, **kwargs)
-    elif ndims == 3:
-        mdsfld = [ _mds2D(fld[a,:,:], **kwargs)
-                 for a in range(fld.shape[0]) ]
-    elif ndims == 4:
-        mdsfld = [ [ _mds2D(fld[a,b,:,:], **kwargs)
-                   for b in range(fld.shape[1]) ]
-                 for a in range(fld.shape[0]) ]
-    elif ndims == 5:
-        mdsfld = [ [ [ _mds2D(fld[a,b,c,:,:], **kwargs)
-                     for c in range(fld.shape[2]) ]
-                   for b in range(fld.shape[1]) ]
-                 for a in range(fld.shape[0]) ]
-    else:
+    if ndims < 2:
         print("wrong number of dimensions")
-        print("only 2 to 5 dimensions are allowed")
+        print("only 2 or more dimensions are allowed")
         sys.exit(__doc__)
 
-    mdsfld = np.array(mdsfld)
+    mdsfld = _mds2D(fld, center)
 
     return mdsfld
 
 def faces(fld):
-    """convert mds multidimensional data into a list with 6 faces"""
+    """convert mds multidimensional data into a list with 6 faces;
+    the faces are views of fld where possible"""
 
-    ndim = len(fld.shape)
-    if ndim == 2:
-        f = _faces2D(fld)
-    else:
-        # use list for dynamical memory allocation, because it is fast
-        if ndim == 3:
-            ff = []
-            nk = fld.shape[0]
-            for k in range(nk):
-                fld2D = fld[k,:,:]
-                f2D = _faces2D(fld2D)
-                ff.append(f2D)
-        elif ndim == 4:
-            ff = []
-            nk = fld.shape[1]
-            nl = fld.shape[0]
-            for l in range(nl):
-                for k in range(nk):
-                    fld2D = fld[l,k,:,:]
-                    f2D = _faces2D(fld2D)
-                    ff.append(f2D)
-        elif ndim == 5:
-            ff = []
-            nk = fld.shape[2]
-            nl = fld.shape[1]
-            nm = fld.shape[0]
-            for m in range(nm):
-                for l in range(nl):
-                    for k in range(nk):
-                        fld2D = fld[m,l,k,:,:]
-                        f2D = _faces2D(fld2D)
-                        ff.append(f2D)
-        # permute list indices so that face index is the first
-        ff = np.transpose(ff)
-        f  = []
-        for listIndex in range(len(ff)):
-            # for each face turn list into array, glue together and reshape
-            nx = ff[listIndex][0].shape[-1]
-            ny = ff[listIndex][0].shape[-2]
-            if   ndim == 3: rshp =       (nk,ny,nx)
-            elif ndim == 4: rshp =    (nl,nk,ny,nx)
-            elif ndim == 5: rshp = (nm,nl,nk,ny,nx)
-            f.append(np.concatenate(np.array(ff[listIndex])).reshape(rshp))
-
-    return f
+    return _faces2D(fld)
 
 def faces2mds(ff):
     """convert 6 faces to mds 2D data,
@@ -317,24 +262,26 @@ def faces2mds(ff):
     return f
 
 def _faces2D(fld):
-    """convert mds 2D data into a list with 6 faces"""
+    """convert mds 2D data into a list with 6 faces
+    (along the last two dimensions)"""
 
     nx = fld.shape[-1]
     ny = fld.shape[-2]
     n = ny//nx//4
+    lead = fld.shape[:-2]
 
     # divide into faces
     f = []
-    f.append(fld[:n*nx,:])
-    f.append(fld[n*nx:2*(n*nx),:])
+    f.append(fld[...,:n*nx,:])
+    f.append(fld[...,n*nx:2*(n*nx),:])
     # arctic face
-    f.append(fld[2*(n*nx):2*(n*nx)+nx,:])
+    f.append(fld[...,2*(n*nx):2*(n*nx)+nx,:])
     # western hemisphere
-    wd = fld[2*(n*nx)+nx:,:].reshape(2*nx,n*nx)
-    f.append(wd[:nx,:])
-    f.append(wd[nx:,:])
+    wd = fld[...,2*(n*nx)+nx:,:].reshape(lead+(2*nx,n*nx))
+    f.append(wd[...,:nx,:])
+    f.append(wd[...,nx:,:])
     # pseudo-sixth face
-    f.append(np.zeros((nx,nx)))
+    f.append(np.zeros(lead+(nx,nx),fld.dtype))
 
     return f
 
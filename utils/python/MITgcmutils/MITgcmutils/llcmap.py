@@ -0,0 +1,199 @@
+"""
+Conversions between the llc mds layout and the global 'flat' layout
+by cached gather indices.
+
+The conversions of :func:`MITgcmutils.llc.flat` and
+:func:`MITgcmutils.llc.mds` only shuffle points, in a way that depends
+on nx and center alone.  This module computes the corresponding index
+maps once (with the llc functions applied to point numbers), keeps them
+in memory and, if :data:`cachedir` is set, in .npy files, and converts
+fields with a single numpy.take over the last two dimensions.
+
+Examples
+--------
+>>> from MITgcmutils import llcmap, iter_rdmds
+>>> llcmap.cachedir = '/scratch/llcmaps'
+>>> Tflat = None
+>>> for it,T,meta in iter_rdmds('T'):
+...     Tflat = llcmap.flat(T, out=Tflat)
+"""
+import os
+import numpy as np
+
+cachedir = None
+"""directory for .npy copies of the index maps (None: memory only)"""
+
+_maps = {}
+
+def _center(center):
+    return 'Pacific' if center == 'Pacific' else 'Atlantic'
+
+def _build(kind, nx, center):
+    """compute index map by converting point numbers with llc"""
+    # llc needs matplotlib, so import it only when a map is not cached
+    from .llc import _flat2D, _mds2D
+    if kind == 'flat':
+        # mds -> flat; points that flat fills with zero get index -1
+        ids = np.arange(1, 13*nx*nx + 1, dtype=np.intp).reshape(13*nx, nx)
+        return _flat2D(ids, center) - 1
+    else:
+        # flat -> mds
+        nj = 3*nx + nx//2
+        ids = np.arange(nj*4*nx, dtype=np.intp).reshape(nj, 4*nx)
+        return _mds2D(ids, center)
+
+def _shape(kind, nx):
+    """shape of the index map (i.e., of the converted field)"""
+    if kind == 'flat':
+        return (3*nx + nx//2, 4*nx)
+    else:
+        return (13*nx, nx)
+
+def _getmap(kind, nx, center):
+    """return (index, mask of zero points or None) from the caches"""
+    center = _center(center)
+    key = (kind, nx, center)
+    try:
+        return _maps[key]
+    except KeyError:
+        pass
+
+    idx = None
+    fname = None
+    if cachedir is not None:
+        fname = os.path.join(cachedir,
+                             'llc{0}_{1}_{2}.npy'.format(nx, kind, center))
+        if os.path.exists(fname):
+            idx = np.load(fname).astype(np.intp, copy=False)
+            if idx.shape != _shape(kind, nx):
+                # not a map for this grid, replace it
+                idx = None
+    if idx is None:
+        idx = _build(kind, nx, center)
+        if fname is not None:
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                # may have been created by another process
+                if not os.path.isdir(cachedir):
+                    raise
+            # write under a temporary name so readers never see half a file
+            tmpname = '{0}.{1}.tmp.npy'.format(fname[:-4], os.getpid())
+            np.save(tmpname, idx)
+            os.replace(tmpname, fname)
+
+    empty = idx < 0
+    if not empty.any():
+        empty = None
+    idx.flags.writeable = False
+    _maps[key] = idx, empty
+    return idx, empty
+
+def flatindex(nx, center='Atlantic'):
+    """
+    Index map from the mds layout to the global 'flat' layout.
+
+    Parameters
+    ----------
+    nx : int
+        face size of the llc grid
+    center : {'Atlantic', 'Pacific'}
+        ocean in the center of the flat field, as for llc.flat
+
+    Returns
+    -------
+    idx : array of int, shape (3*nx + nx//2, 4*nx)
+        (read-only) position of each flat point in the raveled 2D mds
+        field, -1 for points not covered by the mds field (set to zero)
+    """
+    return _getmap('flat', nx, center)[0]
+
+def mdsindex(nx, center='Atlantic'):
+    """
+    Index map from the global 'flat' layout to the mds layout.
+
+    Parameters
+    ----------
+    nx : int
+        face size of the llc grid
+    center : {'Atlantic', 'Pacific'}
+        ocean in the center of the flat field, as for llc.mds
+
+    Returns
+    -------
+    idx : array of int, shape (13*nx, nx)
+        (read-only) position of each mds point in the raveled 2D flat field
+    """
+    return _getmap('mds', nx, center)[0]
+
+def _gather(kind, fld, nx, nj, center, out):
+    if fld.ndim < 2:
+        raise ValueError('Need at least 2 dimensions, got {}'.format(fld.ndim))
+    if fld.shape[-2] != nj:
+        raise ValueError('Wrong shape for llc field: {}'.format(fld.shape))
+    idx, empty = _getmap(kind, nx, center)
+    lead = fld.shape[:-2]
+    shape = lead + idx.shape
+    if out is None:
+        out = np.empty(shape, fld.dtype)
+    elif out.shape != shape:
+        raise ValueError('out has shape {}, need {}'.format(out.shape, shape))
+    elif out.dtype != fld.dtype:
+        raise ValueError('out has type {}, need {}'.format(out.dtype, fld.dtype))
+    # clip is needed for the -1 entries and lets take write to out directly
+    np.take(fld.reshape(lead + (-1,)), idx, axis=-1, out=out, mode='clip')
+    if empty is not None:
+        out[..., empty] = 0
+    return out
+
+def flat(fld, center='Atlantic', out=None):
+    """
+    Convert mds data into the global 'flat' field, like llc.flat.
+
+    The conversion applies to the last two dimensions of fields with
+    2 or more dimensions.
+
+    Parameters
+    ----------
+    fld : array_like, shape (..., 13*nx, nx)
+        field in mds layout
+    center : {'Atlantic', 'Pacific'}
+        ocean in the center of the flat field
+    out : ndarray, shape (..., 3*nx + nx//2, 4*nx), optional
+        array to store the result in, e.g. from a previous call; must
+        have the type of `fld`
+
+    Returns
+    -------
+    out : ndarray
+        flat field
+    """
+    fld = np.asarray(fld)
+    nx = fld.shape[-1]
+    return _gather('flat', fld, nx, 13*nx, center, out)
+
+def mds(fld, center='Atlantic', out=None):
+    """
+    Convert a global 'flat' field into mds data, like llc.mds.
+
+    The conversion applies to the last two dimensions of fields with
+    2 or more dimensions.
+
+    Parameters
+    ----------
+    fld : array_like, shape (..., 3*nx + nx//2, 4*nx)
+        flat field
+    center : {'Atlantic', 'Pacific'}
+        ocean in the center of the flat field
+    out : ndarray, shape (..., 13*nx, nx), optional
+        array to store the result in, e.g. from a previous call; must
+        have the type of `fld`
+
+    Returns
+    -------
+    out : ndarray
+        field in mds layout
+    """
+    fld = np.asarray(fld)
+    nx = fld.shape[-1]//4
+    return _gather('mds', fld, nx, 3*nx + nx//2, center, out)
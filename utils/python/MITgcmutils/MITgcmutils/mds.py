@@ -1,19 +1,19 @@
 import sys
+import os
 import re
 import glob
+import functools
 import numpy as np
 from operator import mul
 
 debug = False
 
+# default number of threads used by rdmds for reading tile files
+default_workers = 1
+
 ################################################################################
 # metafile parsing
 
-# for python2.5
-try: next
-except NameError:
-    def next ( obj ): return obj.next()
-
 _currentline = ''
 
 class ParseError(ValueError):
@@ -25,7 +25,7 @@ class ParseError(ValueError):
         except AttributeError:
             name = metafile
 
-        return '\n'.join(('in metafile: '+name,)
+        return '\n'.join(('in metafile: '+str(name),)
                          + lines
                          + ('in: ' + _currentline,))
 
@@ -49,18 +49,13 @@ def strip_comments(text):
     return re.sub(_comment_pattern, _comment_replacer, text)
 
 
-_string_pattern = re.compile(r"'(.*)'$")
-
 def _parse1(s):
     """ convert one item to appropriate type """
-    m = _string_pattern.match(s)
-    if m:
-        s = m.group(1)
+    if len(s) > 1 and s[0] == "'" and s[-1] == "'":
         # unquote quotes
-        s = re.sub(r"''","'",s)
-        return s
+        return s[1:-1].replace("''","'")
 
-    if '.' in s or 'e' in s.lower():
+    if '.' in s or 'e' in s or 'E' in s:
         return float(s)
     else:
         try:
@@ -73,62 +68,113 @@ _closing = {'[':']',
             '{':'}',
            }
 
+# one "key = [ ... ];" or "key = { ... };" statement, possibly spanning lines
+_statement_pattern = re.compile(r'\s*(\w*) *= *(?:\[([^]]*)\]|\{([^}]*)\});[ \t\r]*(?:\n|$)')
+
+# parsed values of statements, shared by all meta files
+_valuecache = {}
+
+# parsed meta files by (path, modification time, size)
+_metacache = {}
+
+# number of entries after which the caches are cleared
+metacachesize = 10000
+
+
+def _parsevalue(opening, text):
+    """ parse the text between delimiters (may contain newlines) """
+    global _currentline
+    try:
+        return list(_valuecache[opening, text])
+    except KeyError:
+        pass
+
+    # join lines like the line-by-line parser did
+    lines = text.split('\n')
+    line = lines[0].rstrip(' ') + ''.join(' ' + l.rstrip() for l in lines[1:])
+    line = line.strip(" ,")
+    _currentline = line
+
+    if opening == '[':
+        # [] can contain any type of values, separated by commas
+        val = [ _parse1(s) for s in re.split(r'[, ] *',line) ]
+    else:
+        # {} can only contain single quote-delimited strings separated by space
+        val = [ s.rstrip() for s in re.split(r"'  *'", line.strip("'")) ]
+
+    if len(_valuecache) >= metacachesize:
+        _valuecache.clear()
+    _valuecache[opening, text] = val
+    return list(val)
+
+
+def _parseerror(metafile, text):
+    """ return ParseError describing the first unparsable statement in text """
+    global _currentline
+    line = text.lstrip().split('\n', 1)[0]
+    m = re.match(r' *(\w*) *= *(.*?) *$', line)
+    if m is None:
+        return ParseError(metafile, line)
+    line = m.group(2)
+    _currentline = line
+    closing = _closing.get(line[:1])
+    if closing is None:
+        return ParseError(metafile, line, 'Values must be enclosed in [] or {}.')
+    if closing not in text:
+        return ParseError(metafile, line, 'No closing ' + closing + ' found.')
+    return ParseError(metafile, line, 'Values must be enclosed in "[ ];" or "{ };".')
+
+
 def parsemeta(metafile):
     """ parses metafile (file object or filename) into a dictionary of lists
         of floats, ints or strings
-    """
-    global _currentline
 
+        Results for file names are cached (keyed by path, modification time
+        and size), and values are cached across files, so that the meta
+        files of all tiles of a field, which differ only in dimList, are
+        essentially parsed once.
+    """
     try:
-        lines = open(metafile)
+        st = os.stat(metafile)
     except TypeError:
-        lines = iter(metafile)
-
-    d = {}
-    for line in lines:
-        line = strip_comments(line)
-        # skip empty lines
-        if re.match(r'\s*$', line):
-            continue
-
-        m = re.match(r' *(\w*) *= *(.*?) *$', line)
-        if m:
-            key,line = m.groups()
-        else:
-            raise ParseError(metafile,line)
-
-        # look for the opening delimiter ('[' or '{')
-        opening = line[0]
+        # file object or iterable of lines
+        try:
+            text = metafile.read()
+        except AttributeError:
+            text = ''.join( l if l.endswith('\n') else l + '\n' for l in metafile )
+        cachekey = None
+    else:
+        cachekey = (os.path.abspath(metafile), st.st_mtime, st.st_size)
         try:
-            closing = _closing[opening]
+            d = _metacache[cachekey]
         except KeyError:
-            raise ParseError(metafile,line,'Values must be enclosed in [] or {}.')
-
-        # read more lines until a matching closing delimiter is found
-        while closing not in line:
-            try:
-                nextline = next(lines)
-            except StopIteration:
-                raise ParseError(metafile,line,'No closing ' + closing + ' found.')
-
-            line += ' ' + strip_comments(nextline).rstrip()
-
-        if line[-2:] != closing + ';':
-            raise ParseError(metafile,line,
-                             'Values must be enclosed in "[ ];" or "{ };".')
+            with open(metafile) as f:
+                text = f.read()
+        else:
+            return dict( (k, list(v)) for k,v in d.items() )
 
-        # remove delimiters
-        line = line[1:-2].strip(" ,")
-        _currentline = line
+    text = strip_comments(text)
 
-        if opening == '[':
-            # [] can contain any type of values, separated by commas
-            val = [ _parse1(s) for s in re.split(r'[, ] *',line) ]
+    d = {}
+    pos = 0
+    while True:
+        m = _statement_pattern.match(text, pos)
+        if m is None:
+            break
+        key, bracketed, braced = m.groups()
+        if bracketed is not None:
+            d[key] = _parsevalue('[', bracketed)
         else:
-            # {} can only contain single quote-delimited strings separated by space
-            val = [ s.rstrip() for s in re.split(r"'  *'", line.strip("'")) ]
+            d[key] = _parsevalue('{', braced)
+        pos = m.end()
 
-        d[key] = val
+    if text[pos:].strip():
+        raise _parseerror(metafile, text[pos:])
+
+    if cachekey is not None:
+        if len(_metacache) >= metacachesize:
+            _metacache.clear()
+        _metacache[cachekey] = dict( (k, list(v)) for k,v in d.items() )
 
     return d
 
@@ -171,8 +217,12 @@ def scanforfiles(fname):
 
 
 def readmeta(f):
-    """ read meta file and extract tile/timestep-specific parameters """
-    meta = parsemeta(f)
+    """ read meta file (or dictionary returned by parsemeta) and extract
+        tile/timestep-specific parameters """
+    if isinstance(f, dict):
+        meta = dict(f)
+    else:
+        meta = parsemeta(f)
     dimList = meta.pop('dimList')
     # pythonize
     gdims = tuple(dimList[-3::-3])
@@ -187,6 +237,19 @@ def readmeta(f):
     return gdims,i0s,ies,timeStepNumber,timeInterval,map2gl,meta
 
 
+def _findmetafiles(fname, catalog=None):
+    """ return list of meta files for fname and list of either the same
+        file names or parsed meta data (from catalog) """
+    if catalog is None:
+        metafiles = glob.glob(fname + 2*('.'+3*'[0-9]') + '.meta') or glob.glob(fname+'.meta')
+        metas = metafiles
+    else:
+        metafiles,metas = catalog.lookup(fname)
+    if len(metafiles) == 0:
+        raise IOError('No files found for ' + fname + '.meta')
+    return metafiles, metas
+
+
 _typeprefixes = {'ieee-be':'>',
                  'b'      :'>',
                  '>'      :'>',
@@ -200,7 +263,8 @@ _typesuffixes = {'float32':'f4',
 
 def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
           returnmeta=False,astype=float,region=None,lev=(),
-          usememmap=False,mm=False,squeeze=True,verbose=False):
+          usememmap=False,mm=False,squeeze=True,verbose=False,workers=None,
+          catalog=None,lazy=False):
     """
     Read meta-data files as written by MITgcm.
 
@@ -253,12 +317,26 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
     usememmap : bool
         if True, use a memory map for reading data (default False)
         recommended when using lev, or region with global files
-        to save memory and, possibly, time
+        to save memory and, possibly, time.  If, in addition, astype is
+        None and a single global file of one iteration is read whole
+        (no rec, lev or region), the read-only memory map itself is
+        returned (in the byte order of the file), without copying the data
+    workers : int or None
+        number of threads used to read tile files concurrently
+        (default: `default_workers`, normally 1, i.e., serial reading).
+        Useful for output split into many tiles on a parallel filesystem.
+    catalog : MDSCatalog or None
+        if given, look up files and meta data in this catalog instead of
+        searching the file system and parsing meta files
+    lazy : bool
+        if True, do not read any data but return an MDSArray which reads
+        only the tiles, records, levels and rows needed when it is indexed.
+        The meta data are then taken from the first iteration only.
 
     Returns
     -------
     a : array_like
-        numpy array of the data read
+        numpy array of the data read (MDSArray if lazy is True)
     its : list of int
         list of iteration numbers read (only if returnmeta=True)
     meta : dict
@@ -279,8 +357,14 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
     >>> a = rdmds('diags',2880,rec=0,lev=([0],r_[:2,5:8]))  # same as previous
     >>> a = rdmds('diags',2880,rec=0)[0, [0,1,5,6,7], ...]  # same, but less efficient
     >>> a = rdmds('diags',2880)[0, 0, [0,1,5,6,7], ...]     # even less efficient
+    >>> T = rdmds('T',2880,workers=16)  # read tiles with 16 threads
+    >>> cat = MDSCatalog('run')
+    >>> T,its,meta = rdmds('run/T',numpy.NaN,returnmeta=True,catalog=cat)
+    >>> T = rdmds('T',numpy.NaN,lazy=True)
+    >>> sst = T[..., 0, :, :]  # reads only the first level of all iterations
     """
-    import functools
+    if workers is None:
+        workers = default_workers
     usememmap = usememmap or mm
     if usememmap:
         readdata = np.memmap
@@ -289,15 +373,19 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
 
     # add iteration number to file name unless itrs is -1
     additrs = itrs != -1
+    if catalog is None:
+        findits = scanforfiles
+    else:
+        findits = catalog.iterations
     if itrs is np.nan:
         # all iterations
-        itrs = scanforfiles(fnamearg)
+        itrs = findits(fnamearg)
         if verbose: warning('Reading {0} time levels: '.format(len(itrs)), *itrs)
         returnits = True
         itrsislist = True
     elif itrs is np.inf:
         # last iteration
-        itrs = scanforfiles(fnamearg)
+        itrs = findits(fnamearg)
         if len(itrs):
             if verbose: warning('Found {0} time levels, reading'.format(len(itrs)), itrs[-1])
         else:
@@ -321,6 +409,11 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
     levinds = np.ix_(*levs)
     nlev = len(levdims)
 
+    # with a memory map, whole global files in their own data type are not
+    # copied
+    zerocopy = (usememmap and astype is None and region is None and allrec
+                and nlev == 0)
+
     if usememmap:
         recsatonce = True
         readdata = np.memmap
@@ -333,26 +426,85 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
     except KeyError:
         raise ValueError('Allowed machineformats: ' + ' '.join(_typeprefixes))
 
+    if lazy:
+        if additrs:
+            fname = fnamearg + '.{0:010d}'.format(int(itrs[0]))
+        else:
+            fname = fnamearg
+        metafiles,metas = _findmetafiles(fname, catalog)
+        gdims,i0s,ies,timestep,timeinterval,map2gl,meta = readmeta(metas[0])
+        try:
+            dataprec, = meta['dataprec']
+        except KeyError:
+            dataprec, = meta['format']
+        tp = typepre + _typesuffixes[dataprec]
+        if astype is None: astype = tp
+        if allrec:
+            reclist = list(range(meta['nrecords'][0]))
+        assert nlev+2 <= len(gdims)
+        # make lists of levels for all non-x,y dimensions
+        levs = levs + tuple( list(range(n)) for n in gdims[nlev:-2] )
+        if region is None:
+            region = (0, gdims[-1], 0, gdims[-2])
+        region = tuple( i + gdims[-1-k//2] if i < 0 else i for k,i in enumerate(region) )
+        # which dimensions will be visible, like the squeeze below
+        dims = (len(itrs),len(reclist)) + levdims
+        if squeeze:
+            keepers = [ d > 1 for d in dims ]
+        else:
+            keepers = [itrsislist, np.iterable(rec)] + [np.iterable(l) for l in lev]
+        keepers += (len(levs) - nlev + 2)*[True]
+        arr = MDSArray(fnamearg, itrs, additrs, reclist, levs, region,
+                       gdims[-2:], np.dtype(astype), keepers, meta,
+                       dict(machineformat=machineformat, fill_value=fill_value,
+                            astype=astype, usememmap=usememmap, workers=workers,
+                            catalog=catalog))
+        if returnmeta:
+            meta = dict((k.lower(),v) for k,v in arr.meta.items())
+            return arr,itrs,meta
+        else:
+            return arr
+
+    def readtile(tile):
+        """ read one tile file into its part of arr """
+        datafile, arrtile, srcinds, pick = tile
+        if debug and srcinds: message(datafile, srcinds[1:])
+        if pick is None:
+            # whole block of data goes to arrtile
+            pick = (Ellipsis, Ellipsis)
+        dstinds, pickinds = pick
+        if recsatonce:
+            data = readdata(datafile, tp, shape=tileshape)[recinds + srcinds]
+            arrtile[dstinds] = data[pickinds]
+        else:
+            with open(datafile, 'rb') as f:
+                for irec,recnum in enumerate(reclist):
+                    if recnum < 0: recnum += nrecords
+                    f.seek(recnum*count*size)
+                    tilerec = np.fromfile(f, tp, count=count).reshape(recshape)
+                    arrtile[irec][dstinds] = tilerec[levinds + srcinds][pickinds]
+
     arr = None
     metaref = {}
     timeStepNumbers = []
     timeIntervals = []
+    # list of (datafile, target array, source indices, point selection)
+    # to read
+    tiles = []
     for iit,it in enumerate(itrs):
         if additrs:
             fname = fnamearg + '.{0:010d}'.format(int(it))
         else:
             fname = fnamearg
 
-        metafiles = glob.glob(fname + 2*('.'+3*'[0-9]') + '.meta') or glob.glob(fname+'.meta')
-        if len(metafiles) == 0:
-            raise IOError('No files found for ' + fname + '.meta')
+        metafiles,metas = _findmetafiles(fname, catalog)
 
         if verbose: warning(metafiles[0])
 
         if debug: warning('Found',len(metafiles),'metafiles for iteration',it)
 
-        for metafile in metafiles:
-            gdims,i0s,ies,timestep,timeinterval,map2gl,meta = readmeta(metafile)
+        for metafile,metaf in zip(metafiles,metas):
+            gdims,i0s,ies,timestep,timeinterval,map2gl,meta = readmeta(metaf)
             if arr is None:
                 # initialize, allocate
                 try:
@@ -383,16 +535,26 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
 
                 assert nlev+2 <= len(gdims)
                 rdims = levdims + gdims[len(levdims):-2] + (rje-rj0,rie-ri0)
+                metaref = meta
+                if (zerocopy and len(itrs) == 1 and len(metafiles) == 1
+                        and map2gl is None and recshape == gdims):
+                    # single global file read whole: return the memory map
+                    # itself instead of copying it into a new array
+                    datafile = metafile[:-4] + 'data'
+                    arr = np.memmap(datafile, tp, mode='r',
+                                    shape=(1,)+tileshape)
+                    break
                 # always include itrs and rec dimensions and squeeze later
                 arr = np.empty((len(itrs),len(reclist))+rdims, astype)
                 arr[...] = fill_value
-                metaref = meta
             else:
                 if meta != metaref:
                     raise ValueError('Meta files not compatible')
 
             datafile = metafile[:-4] + 'data'
 
+            srcinds = ()
+            pick = None
             if region is not None:
                 if map2gl is None:
                     # overlap of tile with region:
@@ -410,11 +572,39 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
                     ies[-1] = ie - ri0
                     i0s[-2] = j0 - rj0
                     ies[-2] = je - rj0
+                    if Ie <= I0 or Je <= J0:
+                        # tile does not intersect region
+                        continue
+                    srcinds = np.s_[...,J0:Je,I0:Ie]
                 else:
-                    raise NotImplementedError('Region selection is not implemented for map2glob != [0,1]')
+                    # global x,y position of each point of the tile
+                    ny,nx = gdims[-2:]
+                    jstride = map2gl[1]*nx + map2gl[0]
+                    tny = ies[-2] - i0s[-2]
+                    tnx = ies[-1] - i0s[-1]
+                    flat = (nx*i0s[-2] + i0s[-1]
+                            + jstride*np.arange(tny)[:,None] + np.arange(tnx))
+                    y,x = divmod(flat, nx)
+                    inregion = (x >= ri0) & (x < rie) & (y >= rj0) & (y < rje)
+                    if not inregion.any():
+                        # tile does not intersect region
+                        continue
+                    # read only rows and columns with points in region
+                    rows, = np.nonzero(inregion.any(1))
+                    cols, = np.nonzero(inregion.any(0))
+                    J0,Je = rows[0], rows[-1] + 1
+                    I0,Ie = cols[0], cols[-1] + 1
+                    srcinds = np.s_[...,J0:Je,I0:Ie]
+                    # and scatter the points in region into arr
+                    jj,ii = np.nonzero(inregion[J0:Je,I0:Ie])
+                    pick = ((Ellipsis, y[J0+jj,I0+ii] - rj0, x[J0+jj,I0+ii] - ri0),
+                            (Ellipsis, jj, ii))
 
             sl = tuple( slice(i0,ie) for i0,ie in zip(i0s,ies) )
-            if map2gl is None:
+            if pick is not None:
+                # points are scattered into x,y of arr (all records)
+                arrtile = arr[iit][(slice(None),)+sl[:-2]]
+            elif map2gl is None:
                 # part of arr that will receive tile (all records)
                 arrtile = arr[(iit,slice(None))+sl]
             else:
@@ -438,26 +628,7 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
                 arrtile = arrmap[(iit,slice(None))+sl[:-2]]
                 del arrflat,arrmap
 
-            if recsatonce:
-                if region is None:
-                    arrtile[...] = readdata(datafile, tp, shape=tileshape)[recinds]
-                else:
-                    if Ie > I0 and Je > J0:
-                        if debug: message(datafile, I0,Ie,J0,Je)
-                        arrtile[...] = readdata(datafile, tp, shape=tileshape)[recinds + np.s_[...,J0:Je,I0:Ie]]
-            else:
-                f = open(datafile)
-                for irec,recnum in enumerate(reclist):
-                    if recnum < 0: recnum += nrecords
-                    f.seek(recnum*count*size)
-                    if region is None:
-                        arrtile[irec] = np.fromfile(f, tp, count=count).reshape(recshape)[levinds]
-                    else:
-                        if Ie > I0 and Je > J0:
-                            if debug: message(datafile, I0,Ie,J0,Je)
-                            tilerec = np.fromfile(f, tp, count=count).reshape(recshape)
-                            arrtile[irec] = tilerec[levinds + np.s_[...,J0:Je,I0:Ie]]
-                f.close()
+            tiles.append((datafile, arrtile, srcinds, pick))
 
         if timestep is not None:
             timeStepNumbers.extend(timestep)
@@ -465,6 +636,16 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
         if timeinterval is not None:
             timeIntervals.append(timeinterval)
 
+    if workers > 1 and len(tiles) > 1:
+        # numpy releases the GIL while reading, so threads overlap the I/O
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            for _ in pool.map(readtile, tiles): pass
+    else:
+        for tile in tiles:
+            readtile(tile)
+    del tiles
+
     # put list of iteration numbers back into metadata dictionary
     if len(timeStepNumbers):
         metaref['timeStepNumber'] = timeStepNumbers
@@ -496,14 +677,227 @@ def rdmds(fnamearg,itrs=-1,machineformat='b',rec=None,fill_value=0,
         return arr
 
 
+def iter_rdmds(fnamearg, itrs=np.nan, prefetch=1, catalog=None, **kwargs):
+    """
+    Iterate over the time levels of an mds field, one iteration at a time.
+
+    While an iteration is being processed by the caller, the next
+    `prefetch` iterations are read in background threads, so that
+    computation and I/O overlap.  At most `prefetch`+2 time levels are
+    held in memory at any time: the one being processed, those read
+    ahead, and one being read while the caller still holds the previous.
+
+    Call signature::
+
+        for it,a,meta in iter_rdmds(fname, itrs, ...):
+            ...
+
+    Parameters
+    ----------
+    fname : string
+        name of files to read, without iteration number and suffix
+    itrs : list of int or np.NaN or np.Inf
+        iteration numbers; np.NaN (default) for all iterations found,
+        np.Inf for the last one
+    prefetch : int
+        number of iterations to read ahead (default 1; 0 reads serially)
+    catalog : MDSCatalog or None
+        catalog to use for finding iterations and files (see rdmds)
+    kwargs
+        passed to rdmds (except itrs and returnmeta)
+
+    Yields
+    ------
+    it : int
+        iteration number
+    a : array_like
+        numpy array of the data for this iteration, as returned by rdmds
+    meta : dict
+        dictionary of metadata for this iteration
+
+    Examples
+    --------
+    >>> Tsum = 0.
+    >>> for it,T,meta in iter_rdmds('T', prefetch=2):
+    ...     Tsum = Tsum + T
+    """
+    if itrs is np.nan or itrs is np.inf:
+        if catalog is None:
+            its = scanforfiles(fnamearg)
+        else:
+            its = catalog.iterations(fnamearg)
+        if itrs is np.inf:
+            its = its[-1:]
+        itrs = its
+
+    itrs = _aslist(itrs)
+
+    def read(it):
+        a,_,meta = rdmds(fnamearg, it, returnmeta=True, catalog=catalog, **kwargs)
+        return it,a,meta
+
+    if prefetch < 1:
+        for it in itrs:
+            yield read(it)
+        return
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    pool = ThreadPoolExecutor(prefetch)
+    pending = deque()
+    try:
+        for it in itrs:
+            pending.append(pool.submit(read, it))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # generator may be closed early; do not read any further
+        for future in pending:
+            future.cancel()
+        pool.shutdown()
+
+
+class MDSArray(object):
+    """
+    An array-like view of mds files that reads data only when indexed.
+
+    Returned by rdmds(..., lazy=True).  Indexing with integers, slices,
+    Ellipsis and 1-d lists of integers is supported; lists are applied
+    to each dimension independently (like the lev argument of rdmds).
+    Only the iterations, records, levels and the x-y box (and thus the
+    tiles) covered by the index are read.
+
+    Attributes
+    ----------
+    shape : tuple of int
+        shape of the array
+    dtype : numpy.dtype
+        data type of the array
+    itrs : list of int
+        iteration numbers
+    meta : dict
+        meta data of the first file
+    """
+
+    def __init__(self, fname, itrs, additrs, reclist, levs, region, gshape,
+                 dtype, keepers, meta, readopts):
+        self._fname = fname
+        self._additrs = additrs
+        self.itrs = list(itrs)
+        self.meta = meta
+        self.dtype = dtype
+        # file-level values for each non-x,y dimension
+        self._lists = [ self.itrs, list(reclist) ] + [ list(l) for l in levs ]
+        x0,xe,y0,ye = region
+        self._offsets = (y0, x0)
+        self._gshape = tuple(gshape)
+        self._fullshape = tuple(len(l) for l in self._lists) + (ye-y0, xe-x0)
+        self._keepers = keepers
+        self.shape = tuple( n for n,keep in zip(self._fullshape, keepers) if keep )
+        self._readopts = readopts
+
+    ndim = property(lambda self: len(self.shape))
+    size = property(lambda self: int(np.prod(self.shape)))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return 'MDSArray({0!r}, shape={1}, dtype={2})'.format(
+               self._fname, self.shape, self.dtype)
+
+    def __array__(self, dtype=None):
+        a = self[...]
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+    def _expandindex(self, ind):
+        """ turn ind into a tuple with one entry per unsqueezed dimension """
+        if not isinstance(ind, tuple):
+            ind = (ind,)
+        if any(i is Ellipsis for i in ind):
+            cut = [ i is Ellipsis for i in ind ].index(True)
+            ind = (ind[:cut] + (self.ndim-len(ind)+1)*(slice(None),)
+                   + tuple(i for i in ind[cut+1:] if i is not Ellipsis))
+        if len(ind) > self.ndim:
+            raise IndexError('too many indices for MDSArray')
+        ind = list(ind) + (self.ndim-len(ind))*[slice(None)]
+        return [ ind.pop(0) if keep else 0 for keep in self._keepers ]
+
+    def __getitem__(self, ind):
+        ind = self._expandindex(ind)
+        sel = []
+        local = []
+        outshape = []
+        for k,(i,n) in enumerate(zip(ind, self._fullshape)):
+            if i is None or isinstance(i, (float, np.floating)):
+                raise IndexError('only integers, slices, Ellipsis and lists '
+                                 'of integers are valid indices')
+            pos = np.arange(n)[i]
+            if isinstance(i, slice) or np.ndim(pos):
+                outshape.append(np.size(pos))
+            if np.size(pos) == 0:
+                sel = None
+                continue
+            if sel is None:
+                continue
+            if k < len(self._lists):
+                # read exactly the selected iterations/records/levels
+                sel.append([ self._lists[k][p] for p in np.atleast_1d(pos) ])
+                local.append(0 if np.ndim(pos) == 0 else slice(None))
+            else:
+                # read the bounding box in x and y
+                lo = int(np.min(pos))
+                sel.append((lo + self._offsets[k-len(self._lists)], int(np.max(pos)) + 1
+                           + self._offsets[k-len(self._lists)]))
+                if isinstance(i, slice):
+                    r = range(n)[i]
+                    stop = r.stop - lo
+                    local.append(slice(r.start - lo, stop if stop >= 0 else None, r.step))
+                else:
+                    local.append(pos - lo)
+
+        if sel is None:
+            return np.zeros(outshape, self.dtype)
+
+        its,recs = sel[:2]
+        levs = tuple(sel[2:-2])
+        (y0,ye),(x0,xe) = sel[-2:]
+        if not self._additrs:
+            its = -1
+        ny,nx = self._gshape
+        if (x0,xe,y0,ye) == (0,nx,0,ny):
+            region = None
+        else:
+            region = (x0,xe,y0,ye)
+        a = rdmds(self._fname, its, rec=recs, lev=levs, region=region,
+                  squeeze=False, **self._readopts)
+        a = a.reshape(tuple(len(l) for l in sel[:-2]) + (ye-y0, xe-x0))
+        # apply local indices one dimension at a time, last first
+        for k in range(len(local)-1, -1, -1):
+            i = local[k]
+            if isinstance(i, slice):
+                if i != slice(None):
+                    a = a[k*(slice(None),) + (i,)]
+            else:
+                a = np.take(a, i, axis=k)
+        return a
+
+
 def wrmds(fbase, arr, itr=None, dataprec='float32', ndims=None, nrecords=None,
           times=None, fields=None, simulation=None, machineformat='b',
-          deltat=None, dimlist=None):
+          deltat=None, dimlist=None, tiles=None, workers=None):
     '''Write an array to an mds meta/data file set.
 
     If itr is given, the files will be named fbase.0000000itr.data and
     fbase.0000000itr.meta, otherwise just fbase.data and fbase.meta.
 
+    The data are converted to the file's data type in chunks; to write
+    fields too large to hold in memory, use :class:`MDSWriter`.
+
     Parameters
     ----------
     fbase : string
@@ -536,6 +930,13 @@ def wrmds(fbase, arr, itr=None, dataprec='float32', ndims=None, nrecords=None,
     dimlist : tuple
         dimensions as will be stored in file (only useful when passing
         meta data from an existing file to wrmds as keyword args)
+    tiles : tuple of int or None
+        (sNx, sNy): write one meta/data file set per tile of this size,
+        named fbase.001.001.data, ..., like MITgcm with useSingleCpuIO
+        false (default None: write a single global file)
+    workers : int or None
+        number of threads used to write tile files concurrently
+        (default: `default_workers`)
     '''
     if type(dataprec) == type([]): dataprec, = dataprec
     if type(ndims) == type([]): ndims, = ndims
@@ -575,6 +976,58 @@ def wrmds(fbase, arr, itr=None, dataprec='float32', ndims=None, nrecords=None,
 
 #    arr = arr.reshape((-1,)+arr.shape[-ndims:])
 
+    itr,times = _timeinfo(itr, times, deltat)
+
+    if itr is not None:
+        fbase = fbase + '.{:010d}'.format(itr)
+
+    if tiles is None:
+        with open(fbase + '.meta', 'w') as f:
+            _writemeta(f, dims, dataprec, nrec, itr, times, fields, simulation)
+
+        with open(fbase + '.data', 'wb') as f:
+            _writearray(f, arr, tp)
+
+        return
+
+    sNx,sNy = tiles
+    if ndims < 2:
+        raise ValueError('Need at least 2 dimensions for writing tiles')
+    nx,ny = dims[:2]
+    if nx % sNx or ny % sNy:
+        raise ValueError('Tile size {} does not divide domain size {}'
+                         .format((sNx,sNy), (nx,ny)))
+
+    def writetile(bij):
+        bj,bi = divmod(bij, nx//sNx)
+        i0 = bi*sNx
+        j0 = bj*sNy
+        tbase = fbase + '.{:03d}.{:03d}'.format(bi+1, bj+1)
+        extents = [(i0+1, i0+sNx), (j0+1, j0+sNy)] + [(1,d) for d in dims[2:]]
+        with open(tbase + '.meta', 'w') as f:
+            _writemeta(f, dims, dataprec, nrec, itr, times, fields,
+                       simulation, extents)
+
+        with open(tbase + '.data', 'wb') as f:
+            _writearray(f, arr[..., j0:j0+sNy, i0:i0+sNx], tp)
+
+    if workers is None:
+        workers = default_workers
+    ntiles = (nx//sNx)*(ny//sNy)
+    if workers > 1 and ntiles > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            for _ in pool.map(writetile, range(ntiles)): pass
+    else:
+        for bij in range(ntiles):
+            writetile(bij)
+
+
+# number of bytes converted at a time when writing data
+_writechunksize = 2**26
+
+def _timeinfo(itr, times, deltat):
+    """ complete iteration number and times using deltat """
     if times is not None:
         try:
             iter(times)
@@ -589,49 +1042,349 @@ def wrmds(fbase, arr, itr=None, dataprec='float32', ndims=None, nrecords=None,
         else:
             sys.stderr.write('Warning: discarding deltat.\n')
 
+    return itr,times
+
+
+def _writemeta(f, dims, dataprec, nrec, itr=None, times=None, fields=None,
+               simulation=None, extents=None):
+    """ write meta data to open file f; dims are in Fortran order,
+        extents are (1-based) start and end indices of a tile
+    """
+    if extents is None:
+        extents = [ (1,d) for d in dims ]
+
+    if simulation is not None:
+        f.write(" simulation = { '" + simulation + "' };\n")
+
+    f.write(" nDims = [ {:3d} ];\n".format(len(dims)))
+
+    if max(dims) < 10000:
+        fmt = '{:5d}'
+    else:
+        fmt = '{:10d}'
+
+    fmt = fmt + ',' + fmt + ',' + fmt
+
+    f.write(" dimList = [\n " +
+        ",\n ".join(fmt.format(d,i0,ie) for d,(i0,ie) in zip(dims,extents)) +
+        "\n ];\n")
+
+    # skipping m2gl
+
+    f.write(" dataprec = [ '" + dataprec + "' ];\n")
+
+    f.write(" nrecords = [ {:5d} ];\n".format(nrec))
+
     if itr is not None:
-        fbase = fbase + '.{:010d}'.format(itr)
+        f.write(" timeStepNumber = [ {:10d} ];\n".format(itr))
 
-    with open(fbase + '.meta', 'w') as f:
-        if simulation is not None:
-            f.write(" simulation = { '" + simulation + "' };\n")
+    if times is not None:
+        f.write(" timeInterval = [" +
+                "".join("{:20.12E}".format(t) for t in times) +
+                " ];\n")
+
+    if fields is not None:
+        nflds = len(fields)
+        f.write(" nFlds = [ {:4d} ];\n".format(nflds))
+        f.write(" fldList = {\n")
+        for row in range((nflds+19)//20):
+            for field in fields[20*row:20*(row+1)]:
+                f.write(" '{:<8s}'".format(field))
+            f.write("\n")
+        f.write(" };\n")
+
+
+def _writearray(f, arr, tp, chunksize=None):
+    """ write arr to open file f as type tp, converting about chunksize bytes
+        at a time, so that no full-size copy of arr is made
+    """
+    if chunksize is None:
+        chunksize = _writechunksize
+    arr = np.asanyarray(arr)
+    if arr.ndim == 0:
+        arr = arr.reshape(1)
+    rowsize = arr[:1].size*np.dtype(tp).itemsize
+    if arr.ndim > 1 and rowsize > chunksize:
+        for a in arr:
+            _writearray(f, a, tp, chunksize)
+        return
+    n = max(1, chunksize//max(1, rowsize))
+    for i in range(0, len(arr), n):
+        # no copy if arr already has type tp and is contiguous
+        np.ascontiguousarray(arr[i:i+n], tp).tofile(f)
+
+
+class MDSWriter(object):
+    """
+    Write an mds meta/data file set incrementally.
 
-        f.write(" nDims = [ {:3d} ];\n".format(ndims))
+    Records (or parts of records, like single levels) are appended to the
+    data file with :meth:`write` and converted to the file's data type in
+    chunks, so neither the whole field nor a full-size converted copy has to
+    be in memory.  The meta file, with the number of records written, is
+    written by :meth:`close`.  Can be used as a context manager.
 
-        if max(dims) < 10000:
-            fmt = '{:5d}'
-        else:
-            fmt = '{:10d}'
+    Parameters
+    ----------
+    fbase : string
+        Name of file to write, without the '.data' or '.meta' suffixes,
+        and without the iteration number if itr is given
+    shape : tuple of int
+        shape of one record (without record dimension), e.g., (nz, ny, nx)
+    itr : int or None
+        If given, this iteration number will be appended to the file name
+    dataprec : string
+        precision of resulting file ('float32' or 'float64')
+    times : float or list of floats
+        times to write into meta file.  Either a single float or a list
+        of two for a time interval
+    fields : list of strings
+        list of fields
+    simulation : string
+        string describing the simulation
+    machineformat : string
+        'b' or 'l' for big or little endian
+    deltat : float
+        time step; provide in place of either times or itr to have one
+        computed from the other
+    chunksize : int
+        number of bytes to convert at a time (default 64 MB)
 
-        fmt = fmt + ',' + fmt + ',' + fmt
+    Examples
+    --------
+    >>> with MDSWriter('T.init', (nz, ny, nx), dataprec='float64') as w:
+    ...     for k in range(nz):
+    ...         w.write(computelevel(k))
+    """
+    def __init__(self, fbase, shape, itr=None, dataprec='float32', times=None,
+                 fields=None, simulation=None, machineformat='b', deltat=None,
+                 chunksize=None):
+        tp = _typeprefixes[machineformat]
+        try:
+            self.tp = tp + _typesuffixes[dataprec]
+        except KeyError:
+            raise ValueError("dataprec must be 'float32' or 'float64'.")
+
+        self.itr,self.times = _timeinfo(itr, times, deltat)
+        if self.itr is not None:
+            fbase = fbase + '.{:010d}'.format(self.itr)
+        self.fbase = fbase
+        self.shape = tuple(shape)
+        self.dataprec = dataprec
+        self.fields = fields
+        self.simulation = simulation
+        self.chunksize = chunksize
+        self.recsize = int(np.prod(self.shape, dtype=int))
+        self.count = 0
+        self.f = open(fbase + '.data', 'wb')
+
+    def write(self, arr):
+        """
+        Append data to the data file.
+
+        arr is either one or more whole records (its trailing dimensions
+        are the record shape) or a contiguous slab of the current record:
+        any number of consecutive entries along one record dimension, with
+        all of the following dimensions, e.g. A[k], A[k,:2] or A[k,j] of a
+        record A.  A slab must start at a multiple of its (sub)slab size,
+        which is the case when writing slabs of the same shape in order,
+        and must not extend beyond the current record.  A record can thus be
+        written whole, level by level, several levels at a time or several
+        records at once.
+        """
+        arr = np.asanyarray(arr)
+        nd = len(self.shape)
+        pos = self.count % self.recsize
+        if arr.ndim > nd:
+            # whole records
+            if arr.shape[arr.ndim-nd:] != self.shape:
+                raise ValueError('Shape mismatch: {} does not fit records of shape {}'
+                                 .format(arr.shape, self.shape))
+            if pos:
+                raise ValueError('Cannot write whole records after an incomplete record')
+        else:
+            # slab of the current record
+            if arr.shape[1:] != self.shape[nd-arr.ndim+1:]:
+                raise ValueError('Shape mismatch: {} does not fit records of shape {}'
+                                 .format(arr.shape, self.shape))
+            unit = int(np.prod(arr.shape[1:], dtype=int))
+            if pos % unit or pos + arr.size > self.recsize:
+                raise ValueError('Slab of shape {} does not fit at position {} of '
+                                 'a record of shape {}'.format(arr.shape, pos, self.shape))
+        _writearray(self.f, arr, self.tp, self.chunksize)
+        self.count += arr.size
+
+    @property
+    def nrecords(self):
+        """ number of complete records written so far """
+        return self.count//self.recsize
+
+    def close(self):
+        """ close the data file and write the meta file """
+        if self.f is None:
+            return
+        self.f.close()
+        self.f = None
+        if self.count % self.recsize:
+            raise ValueError('Incomplete record written to ' + self.fbase + '.data')
+        with open(self.fbase + '.meta', 'w') as f:
+            _writemeta(f, self.shape[::-1], self.dataprec, self.nrecords,
+                       self.itr, self.times, self.fields, self.simulation)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            # do not write meta data for incomplete file
+            if self.f is not None:
+                self.f.close()
+                self.f = None
 
-        f.write(" dimList = [\n " +
-            ",\n ".join(fmt.format(d,1,d) for d in dims) +
-            "\n ];\n")
 
-        # skipping m2gl
+_catalogpattern = re.compile(r'^(.*?)(?:\.([0-9]{10}))?(?:\.[0-9]{3}\.[0-9]{3})?\.meta$')
+_globchars = re.compile(r'[*?[]')
 
-        f.write(" dataprec = [ '" + dataprec + "' ];\n")
+class MDSCatalog(object):
+    """
+    An on-disk index of the mds meta/data files in a run directory.
 
-        f.write(" nrecords = [ {:5d} ];\n".format(nrec))
+    The directory (including subdirectories) is scanned once and, for every
+    meta file, the field name, iteration number, tile extent (dimList), data
+    type, number of records, field list, record size in bytes and the parsed
+    meta data are stored in an SQLite database.  rdmds can then find files
+    and meta data in the catalog instead of globbing the directory and
+    parsing every meta file again.
 
-        if itr is not None:
-            f.write(" timeStepNumber = [ {:10d} ];\n".format(itr))
+    Parameters
+    ----------
+    dirname : string
+        run directory to index (default: current directory)
+    dbname : string or None
+        database file; default is '.mdscatalog.sqlite' in `dirname`.
+        Use ':memory:' for a catalog that is not saved.
+    update : bool
+        if True, rescan the directory even if the database exists
 
-        if times is not None:
-            f.write(" timeInterval = [" +
-                    "".join("{:20.12E}".format(t) for t in times) +
-                    " ];\n")
+    Notes
+    -----
+    The catalog is not updated automatically.  Call `update` after new
+    output has been written; only new or modified meta files are parsed.
 
-        if fields is not None:
-            nflds = len(fields)
-            f.write(" nFlds = [ {:4d} ];\n".format(nflds))
-            f.write(" fldList = {\n")
-            for row in range((nflds+19)//20):
-                for field in fields[20*row:20*(row+1)]:
-                    f.write(" '{:<8s}'".format(field))
-                f.write("\n")
-            f.write(" };\n")
+    The data of record `rec` starts at byte `rec*recsize` of a data file.
 
-    arr.astype(tp).tofile(fbase + '.data')
+    Examples
+    --------
+    >>> cat = MDSCatalog('run')
+    >>> T = rdmds('run/T', 2880, catalog=cat)
+    >>> its = cat.iterations('run/T')
+    """
 
+    def __init__(self, dirname='.', dbname=None, update=False):
+        import sqlite3
+        import threading
+        self.root = os.path.abspath(dirname)
+        if dbname is None:
+            dbname = os.path.join(self.root, '.mdscatalog.sqlite')
+        self.dbname = dbname
+        isnew = dbname == ':memory:' or not os.path.exists(dbname)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(dbname, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS tiles (
+                               metafile TEXT PRIMARY KEY,
+                               stem TEXT, base TEXT, iter INTEGER,
+                               mtime REAL, size INTEGER,
+                               dataprec TEXT, nrecords INTEGER,
+                               recsize INTEGER, dimlist TEXT,
+                               fldlist TEXT, meta TEXT)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS stemindex ON tiles (stem)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS baseindex ON tiles (base)")
+        if isnew or update:
+            self.update()
+
+    def close(self):
+        """Close the database"""
+        self.db.close()
+
+    def update(self):
+        """
+        Rescan the directory: add new and modified meta files to the
+        catalog and remove those that have disappeared.
+        """
+        import json
+        with self._lock:
+            known = dict((f, (t, n)) for f,t,n in
+                         self.db.execute("SELECT metafile, mtime, size FROM tiles"))
+            rows = []
+            for dirpath,dirnames,filenames in os.walk(self.root):
+                reldir = os.path.relpath(dirpath, self.root)
+                for name in filenames:
+                    m = _catalogpattern.match(name)
+                    if m is None:
+                        continue
+                    path = os.path.join(dirpath, name)
+                    rel = os.path.normpath(os.path.join(reldir, name))
+                    st = os.stat(path)
+                    if known.pop(rel, None) == (st.st_mtime, st.st_size):
+                        continue
+                    base,it = m.groups()
+                    base = os.path.normpath(os.path.join(reldir, base))
+                    stem = base if it is None else base + '.' + it
+                    try:
+                        meta = parsemeta(path)
+                        dataprec, = meta.get('dataprec', meta.get('format'))
+                        nrecords, = meta['nrecords']
+                        dimList = meta['dimList']
+                        if len(dimList) % 3:
+                            raise ValueError('dimList needs 3 entries per dimension')
+                        count = functools.reduce(mul, [ ie-i0+1 for i0,ie in
+                                                        zip(dimList[1::3], dimList[2::3]) ], 1)
+                        recsize = count*np.dtype(_typesuffixes[dataprec]).itemsize
+                    except (ParseError, KeyError, TypeError, ValueError):
+                        if debug: warning('Skipping', path)
+                        continue
+                    fldList = meta.get('fldList')
+                    rows.append((rel, stem, base, it and int(it),
+                                 st.st_mtime, st.st_size, dataprec, nrecords, recsize,
+                                 json.dumps(dimList),
+                                 fldList and json.dumps(fldList),
+                                 json.dumps(meta)))
+
+            with self.db:
+                self.db.executemany("DELETE FROM tiles WHERE metafile = ?",
+                                    [ (f,) for f in known ])
+                self.db.executemany("INSERT OR REPLACE INTO tiles VALUES "
+                                    "(?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+
+    def _query(self, column, fname, what):
+        """ query rows where column matches fname (relative to cwd) """
+        rel = os.path.relpath(os.path.abspath(fname), self.root)
+        op = '=' if _globchars.search(rel) is None else 'GLOB'
+        with self._lock:
+            return self.db.execute('SELECT ' + what + ' FROM tiles WHERE ' +
+                                   column + ' ' + op + ' ? ORDER BY metafile',
+                                   (rel,)).fetchall()
+
+    def iterations(self, fname):
+        """ return sorted list of iteration numbers found for field fname """
+        rows = self._query('base', fname, 'DISTINCT iter')
+        return sorted( it for it, in rows if it is not None )
+
+    def lookup(self, fname):
+        """
+        return list of meta files for fname (including iteration number)
+        and list of parsed meta data dictionaries, as from parsemeta
+        """
+        import json
+        rows = self._query('stem', fname, 'metafile, meta')
+        metafiles = [ os.path.join(self.root, f) for f,_ in rows ]
+        metas = [ json.loads(meta) for _,meta in rows ]
+        return metafiles, metas
+
+    def fields(self):
+        """ return sorted list of field names (without iteration number) """
+        with self._lock:
+            rows = self.db.execute("SELECT DISTINCT base FROM tiles ORDER BY base").fetchall()
+        return [ base for base, in rows ]
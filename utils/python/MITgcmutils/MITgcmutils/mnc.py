@@ -1,8 +1,18 @@
 import sys
+import re
 import glob
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import numpy as np
 from .netcdf import netcdf_file
 
+# default maximum number of tile files kept open by an MNC object
+default_maxopen = 64
+
+# default number of threads used for reading tile files
+default_workers = 1
+
 _exclude_global = ['close',
                    'createDimension',
                    'createVariable',
@@ -10,6 +20,7 @@ _exclude_global = ['close',
                    'filename',
                    'flush',
                    'fp',
+                   'header_only',
                    'mode',
                    'sync',
                    'use_mmap',
@@ -36,6 +47,100 @@ def getattributes(nc, exclude=[]):
     return a
 
 
+class _FilePool(object):
+    """
+    A pool of open netcdf files with a bounded number of open files.
+
+    Files are opened on demand and the least recently used ones are closed
+    when more than `maxopen` are open.  Files in use (between acquire and
+    release) are never closed.  Thread-safe.
+    """
+    def __init__(self, maxopen):
+        self.maxopen = max(1, maxopen)
+        self._open = OrderedDict()
+        self._inuse = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, fname):
+        """ return open netcdf_file for fname and mark it in use """
+        with self._lock:
+            nc = self._open.pop(fname, None)
+            if nc is not None:
+                # move to end: most recently used
+                self._open[fname] = nc
+                self._inuse[fname] = self._inuse.get(fname, 0) + 1
+                return nc
+
+        # do not hold the lock while reading the header
+        nc = netcdf_file(fname, 'r')
+        with self._lock:
+            other = self._open.pop(fname, None)
+            if other is not None:
+                # opened by another thread in the meantime
+                nc.close()
+                nc = other
+            self._open[fname] = nc
+            self._inuse[fname] = self._inuse.get(fname, 0) + 1
+            self._evict()
+        return nc
+
+    def release(self, fname):
+        """ mark file as no longer in use by caller """
+        with self._lock:
+            n = self._inuse.pop(fname) - 1
+            if n:
+                self._inuse[fname] = n
+            self._evict()
+
+    @contextmanager
+    def open(self, fname):
+        """ context manager for acquire/release """
+        nc = self.acquire(fname)
+        try:
+            yield nc
+        finally:
+            self.release(fname)
+
+    def _evict(self):
+        # close least recently used files that are not in use
+        for fname in list(self._open):
+            if len(self._open) <= self.maxopen:
+                break
+            if fname not in self._inuse:
+                self._open.pop(fname).close()
+
+    def close(self):
+        """ close all files """
+        with self._lock:
+            while self._open:
+                self._open.popitem()[1].close()
+            self._inuse.clear()
+
+
+def _splitintime(fnames):
+    """ sort file names into sets of tiles by iteration number
+
+    Returns list of lists of file names (tiles in the same order for all
+    iterations) or None if file names do not contain iteration numbers.
+    """
+    sets = {}
+    for fname in fnames:
+        m = re.match(r'^(.*)\.([0-9]{10})(\.t[0-9]+\.nc)$', fname)
+        if m is None:
+            return None
+        base,it,tile = m.groups()
+        sets.setdefault(int(it), {})[base + tile] = fname
+
+    its = sorted(sets)
+    tiles = sorted(sets[its[0]])
+    for it in its:
+        if sorted(sets[it]) != tiles:
+            raise ValueError('Tiles of iteration {} do not match those of {}'
+                             .format(it, its[0]))
+
+    return [ [ sets[it][tile] for tile in tiles ] for it in its ]
+
+
 class MNC:
     """
     A file object for MNC (tiled NetCDF) data.
@@ -57,6 +162,22 @@ class MNC:
             variables are lists of exch2 faces
 
         default is to use exch2 layout if present, model otherwise
+    maxopen : int
+        maximum number of tile files kept open at a time (default
+        `default_maxopen`).  Tile files are opened when data are read
+        and closed again, least recently used first, when more files
+        would be open.
+    workers : int
+        number of threads used to read tile files concurrently (default
+        `default_workers`, normally 1).  Useful for variables split into
+        many tiles on a parallel file system; use maxopen >= workers.
+    multitime : bool or None
+        if True, fpatt may match several file sets split in time,
+        fname.ITERATION.tNNN.nc, which are presented as one set with a
+        record dimension spanning all of them.  Only the files holding the
+        requested records are read.  If False, all files are taken to be
+        tiles of one set.  Default is to detect sets split in time from the
+        file names.
 
     Example
     -------
@@ -67,31 +188,50 @@ class MNC:
     temp and salt are now assembled (global) arrays of shape (Nt, Nr, Ny, Nx)
     where Nt is the number iterations found in the file (in this case probably 1).
 
-    Notes
-    -----
-    The multitime option is not implemented, i.e., MNC cannot read files split
-    in time.
+    >>> nc = mnc_files('mnc_*/state.*.t*.nc')
+    >>> temp = nc.variables['Temp'][-10:]
+    temp now holds the last 10 records of all files in the set, which may
+    come from several files per tile.
     """
 
     # avoid problems with __del__
-    nc = []
+    _pool = None
+    _nc = None
 
-    def __init__(self, fpatt, layout=None, multitime=False):
+    def __init__(self, fpatt, layout=None, multitime=None, maxopen=None,
+                 workers=None):
         fnames = glob.glob(fpatt)
-#        if multitime:
-#            iters = [ f[-18:-8] for f in fnames if f.endswith('.t001.nc') ]
-#            iters.sort()
-#            fnames_first = [ f for f in fnames if f[-18:-8] == iters[0] ]
-#        else:
-#            fnames_first = fnames
         fnames.sort()
-
-        # open files
-        self.nc = [ netcdf_file(f,'r') for f in fnames ]
-
+        if len(fnames) == 0:
+            raise IOError('No files found matching ' + fpatt)
+
+        # sets of tile files, one per starting iteration
+        if multitime or multitime is None:
+            filesets = _splitintime(fnames)
+            if filesets is None:
+                if multitime:
+                    raise ValueError('Cannot find iteration numbers in file names')
+                filesets = [fnames]
+        else:
+            filesets = [fnames]
+
+        if maxopen is None:
+            maxopen = default_maxopen
+        if workers is None:
+            workers = default_workers
+        self.workers = workers
+        self._filesets = filesets
+        self._fnames = filesets[0]
+        self._pool = _FilePool(maxopen)
+
+        # only meta data are kept; files are opened on demand through the pool
+        nc0 = netcdf_file(self._fnames[0], 'r', header_only=True)
+        self._readmeta(nc0, layout)
+
+    def _readmeta(self, nc0, layout):
         # global attributes
         # get from first file, but remove/reset tile-specific ones
-        self._attributes = getattributes(self.nc[0], _exclude_global)
+        self._attributes = getattributes(nc0, _exclude_global)
         self._attributes['tile_number'] = 1
         self._attributes['bi'] = 1
         self._attributes['bj'] = 1
@@ -114,6 +254,12 @@ class MNC:
 
         self.layout = layout
 
+        # tile-specific attributes of all files
+        tileatts = []
+        for fname in self._fnames:
+            nc = netcdf_file(fname, 'r', header_only=True)
+            tileatts.append(getattributes(nc, _exclude_global))
+
         # precompute indices
         self._i0 = []
         self._ie = []
@@ -124,8 +270,8 @@ class MNC:
         if layout == 'model':
             self._nx = self.Nx
             self._ny = self.Ny
-            for nc in self.nc:
-                tn = nc.tile_number
+            for att in tileatts:
+                tn = att['tile_number']
                 bj,bi = divmod(tn-1, ntx)
                 ie = sNx*(bi+1-ntx)
                 je = sNy*(bj+1-nty)
@@ -136,9 +282,9 @@ class MNC:
         elif layout == 'exch2':
             self._nx = 0
             self._ny = 0
-            for nc in self.nc:
-                i0 = nc.exch2_txGlobalo - 1
-                j0 = nc.exch2_tyGlobalo - 1
+            for att in tileatts:
+                i0 = att['exch2_txGlobalo'] - 1
+                j0 = att['exch2_tyGlobalo'] - 1
                 ie = i0 + sNx
                 je = j0 + sNy
                 self._i0.append(i0)
@@ -156,10 +302,10 @@ class MNC:
         elif layout == 'faces':
             self._nx = {}
             self._ny = {}
-            for nc in self.nc:
-                fn = nc.exch2_myFace
-                i0 = nc.exch2_tBasex
-                j0 = nc.exch2_tBasey
+            for att in tileatts:
+                fn = att['exch2_myFace']
+                i0 = att['exch2_tBasex']
+                j0 = att['exch2_tBasey']
                 ie = i0 + sNx
                 je = j0 + sNy
                 self._fn.append(fn)
@@ -185,9 +331,16 @@ class MNC:
         else:
             raise ValueError('Unknown layout: {}'.format(layout))
 
+        # index of tile origins, sorted in x and y, for finding the tiles
+        # that intersect a window
+        self._xorder = np.argsort(self._i0, kind='stable')
+        self._xsorted = np.array(self._i0)[self._xorder]
+        self._yorder = np.argsort(self._j0, kind='stable')
+        self._ysorted = np.array(self._j0)[self._yorder]
+
         # dimensions
         self.dimensions = {}
-        for k,n in self.nc[0].dimensions.items():
+        for k,n in nc0.dimensions.items():
             # compute size of dimension in global array for X* and Y*
             if k[0] == 'X':
                 n += self._nx - sNx
@@ -196,14 +349,26 @@ class MNC:
             self.dimensions[k] = n
 
         # variables
-        var0 = self.nc[0].variables
+        var0 = nc0.variables
         # find size of record dimension first
         if 'T' in self.dimensions and self.dimensions['T'] is None:
-            self.times = list(var0.get('T', [])[:])
-            self.iters = list(var0.get('iter', self.times)[:])
+            self.times = []
+            self.iters = []
+            # first record and number of records of each file set
+            self._recoffsets = []
+            self._nrecs = []
+            for fileset in self._filesets:
+                with self._pool.open(fileset[0]) as nc:
+                    var = nc.variables
+                    times = list(var.get('T', [])[:])
+                    iters = list(var.get('iter', times)[:])
+                    self._recoffsets.append(len(self.iters))
+                    self._nrecs.append(len(iters))
+                    self.times.extend(times)
+                    self.iters.extend(iters)
             self.nrec = len(self.iters)
 
-        self.variables = dict((k, MNCVariable(self, k)) for k in var0)
+        self.variables = dict((k, MNCVariable(self, k, var0[k])) for k in var0)
 
     def __getattr__(self, k):
         try:
@@ -214,10 +379,25 @@ class MNC:
     def __dir__(self):
         return self.__dict__.keys() + self._attributes.keys()
 
+    @property
+    def nc(self):
+        """
+        list of netcdf_file objects of the tile files (of the first file set
+        if split in time).  Accessing it opens all these files at once,
+        regardless of maxopen, until close; kept for compatibility.
+        """
+        if self._nc is None:
+            self._nc = [ netcdf_file(f, 'r') for f in self._fnames ]
+        return self._nc
+
     def close(self):
         """Close tile files"""
-        for nc in self.nc:
-            nc.close()
+        if self._pool is not None:
+            self._pool.close()
+        if self._nc is not None:
+            for nc in self._nc:
+                nc.close()
+            self._nc = None
 
     __del__ = close
 
@@ -249,12 +429,13 @@ def calcstrides(slices, dims):
         try:
             stride = s.indices(dim)
         except AttributeError:
+            if s < 0:
+                s += dim
             stride = (s, s+1, 1)
             n = 1
         else:
             # real slice, will make a dimension
-            start,stop,step = stride
-            n = (stop-start+step-1)//step
+            n = len(range(*stride))
             shape.append(n)
 
         fullshape.append(n)
@@ -264,9 +445,12 @@ def calcstrides(slices, dims):
 
 
 class MNCVariable(object):
-    def __init__(self, mnc, name):
+    def __init__(self, mnc, name, v0):
         self._name = name
-        self.nc = mnc.nc
+        self._fnames = mnc._fnames
+        self._filesets = mnc._filesets
+        self._pool = mnc._pool
+        self._workers = mnc.workers
         self.layout = mnc.layout
         self._i0 = mnc._i0
         self._ie = mnc._ie
@@ -274,7 +458,10 @@ class MNCVariable(object):
         self._je = mnc._je
         self._nf = mnc._nf
         self._fn = mnc._fn
-        v0 = mnc.nc[0].variables[name]
+        self._xorder = mnc._xorder
+        self._xsorted = mnc._xsorted
+        self._yorder = mnc._yorder
+        self._ysorted = mnc._ysorted
         self._attributes = getattributes(v0, _exclude_var)
         self.itemsize = v0.data.itemsize
         self.typecode = v0.typecode
@@ -284,6 +471,8 @@ class MNCVariable(object):
         self.isrec = self.shape[0] is None
         if self.isrec:
             self.shape = (mnc.nrec,) + self.shape[1:]
+            self._recoffsets = mnc._recoffsets
+            self._nrecs = mnc._nrecs
 
         # which dimensions are tiled
         self._Xdim = None
@@ -301,31 +490,148 @@ class MNCVariable(object):
     def __dir__(self):
         return self.__dict__.keys() + self._attributes.keys()
 
+    def _readtile(self, i, out, outind, ind=slice(None), iset=0):
+        """ read ind of this variable from tile file i of file set iset
+            into out[outind]
+        """
+        with self._pool.open(self._filesets[iset][i]) as nc:
+            out[outind] = nc.variables[self._name][ind]
+
+    def _splitrecs(self, start=0, stop=None, step=1, reclist=None):
+        """ split records range(start, stop, step) or reclist (array of
+            non-negative ints) among file sets
+
+        Returns list of (file set, index into result, index into file set),
+        where the indices are slices or, for reclist, integer arrays.
+        """
+        if not self.isrec or len(self._filesets) == 1:
+            if reclist is not None:
+                return [(0, slice(None), reclist)]
+            return [(0, slice(None), slice(start, stop, step))]
+
+        if reclist is not None:
+            recs = reclist
+        else:
+            if stop is None:
+                stop = self.shape[0]
+            recs = np.arange(start, stop, step)
+        res = []
+        for iset,(off,n) in enumerate(zip(self._recoffsets, self._nrecs)):
+            pos, = np.nonzero((recs >= off) & (recs < off + n))
+            if len(pos):
+                local = recs[pos] - off
+                if reclist is not None:
+                    res.append((iset, pos, local))
+                    continue
+                end = local[-1] + step
+                if end < 0: end = None
+                res.append((iset, slice(pos[0], pos[-1] + 1),
+                            slice(local[0], end, step)))
+        return res
+
+    def _readtiles(self, tiles):
+        """ read list of tiles, (i, out, outind, ind), concurrently if
+            workers > 1 (tiles go into disjoint parts of out)
+        """
+        if self._workers > 1 and len(tiles) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(self._workers) as pool:
+                for _ in pool.map(lambda tile: self._readtile(*tile), tiles): pass
+        else:
+            for tile in tiles:
+                self._readtile(*tile)
+
+    def _findtiles(self, strides):
+        """ return sorted indices of tiles intersecting the x,y window given
+            by strides (tile 0 only if variable is not tiled)
+        """
+        if self._Xdim is None and self._Ydim is None:
+            # all tiles hold the same data
+            return [0]
+
+        tiles = None
+        for dim,order,sorted0,i0,ie in [
+                (self._Xdim, self._xorder, self._xsorted, self._i0, self._ie),
+                (self._Ydim, self._yorder, self._ysorted, self._j0, self._je)]:
+            if dim is None:
+                continue
+            start,stop,step = strides[dim]
+            if step < 0:
+                continue
+            # tile width along dim (same for all tiles)
+            w = self.shape[dim] + (ie[0] or 0) - i0[0]
+            # tiles with start < stop and start + w > window start
+            lo = np.searchsorted(sorted0, start - w + 1)
+            hi = np.searchsorted(sorted0, stop)
+            found = order[lo:hi]
+            if tiles is None:
+                tiles = np.sort(found)
+            else:
+                tiles = np.intersect1d(tiles, found)
+
+        if tiles is None:
+            return range(len(self._fnames))
+        return tiles
+
     def __getitem__(self, ind):
         if self.layout == 'faces':
             return self._getfaces(ind)
 
+        if not isinstance(ind, tuple) and np.ndim(ind) == 1:
+            # bare sequence of records
+            ind = (ind,)
+
         if ind in [Ellipsis, slice(None)]:
             # whole array
             res = np.zeros(self.shape, self.typecode())
             s = [slice(None) for d in self.shape]
-            for i,nc in enumerate(self.nc):
+            if self._Xdim is None and self._Ydim is None:
+                # not tiled, read from one tile only
+                tilelist = [0]
+            else:
+                tilelist = range(len(self._fnames))
+            recsets = self._splitrecs()
+            tiles = []
+            for i in tilelist:
                 if self._Xdim is not None:
                     s[self._Xdim] = slice(self._i0[i], self._ie[i])
                 if self._Ydim is not None:
                     s[self._Ydim] = slice(self._j0[i], self._je[i])
-                res[tuple(s)] = nc.variables[self._name][:]
+                for iset,resrecs,recs in recsets:
+                    if self.isrec:
+                        s[0] = resrecs
+                    tiles.append((i, res, tuple(s), recs, iset))
+            self._readtiles(tiles)
 
             return res
         else:
             # read only required data
+            reclist = None
+            if (self.isrec and isinstance(ind, tuple) and len(ind)
+                    and np.ndim(ind[0]) == 1):
+                # sequence of records: read all of them in one pass per tile
+                reclist = np.array(ind[0], int)
+                reclist[reclist < 0] += self.shape[0]
+                if np.any((reclist < 0) | (reclist >= self.shape[0])):
+                    raise IndexError('record index out of range')
+                ind = (slice(None),) + ind[1:]
             strides,resshape,fullshape = calcstrides(ind, self.shape)
+            if reclist is not None:
+                resshape = (len(reclist),) + resshape[1:]
+                fullshape = (len(reclist),) + fullshape[1:]
             res = np.zeros(fullshape, self.dtype)
             s = [slice(*stride) for stride in strides]
             sres = [slice(None) for d in fullshape]
             if self._Xdim is not None: I0,Ie,Is = strides[self._Xdim]
             if self._Ydim is not None: J0,Je,Js = strides[self._Ydim]
-            for i,nc in enumerate(self.nc):
+            if reclist is not None:
+                recsets = self._splitrecs(reclist=reclist)
+            elif self.isrec:
+                recsets = self._splitrecs(*strides[0])
+            else:
+                recsets = [(0, None, None)]
+            tiles = []
+            for i in self._findtiles(strides):
                 if self._Xdim is not None:
                     i0 = self._i0[i]
                     ie = self.shape[self._Xdim] + (self._ie[i] or 0)
@@ -340,7 +646,16 @@ class MNCVariable(object):
                     e = np.clip(je, J0, Je)
                     sres[self._Ydim] = slice(max(-a, 0), (e - J0)//Js)
                     s[self._Ydim] = slice(max(J0 - j0, b), max(Je - j0, 0), Js)
-                res[tuple(sres)] = nc.variables[self._name][tuple(s)]
+                if any(sres[d].stop <= sres[d].start
+                       for d in (self._Xdim, self._Ydim) if d is not None):
+                    # no points of this tile in window
+                    continue
+                for iset,resrecs,recs in recsets:
+                    if self.isrec:
+                        sres[0] = resrecs
+                        s[0] = recs
+                    tiles.append((i, res, tuple(sres), tuple(s), iset))
+            self._readtiles(tiles)
 
             return res.reshape(resshape)
 
@@ -351,13 +666,19 @@ class MNCVariable(object):
             a = np.zeros(shape, self.typecode())
             res.append(a)
         s = [slice(None) for d in self.shape]
-        for i,nc in enumerate(self.nc):
+        recsets = self._splitrecs()
+        tiles = []
+        for i in range(len(self._fnames)):
             fn = self._fn[i]
             if self._Xdim is not None:
                 s[self._Xdim] = slice(self._i0[i], self._ie[i])
             if self._Ydim is not None:
                 s[self._Ydim] = slice(self._j0[i], self._je[i])
-            res[fn][tuple(s)] = nc.variables[self._name][:]
+            for iset,resrecs,recs in recsets:
+                if self.isrec:
+                    s[0] = resrecs
+                tiles.append((i, res[fn], tuple(s), recs, iset))
+        self._readtiles(tiles)
         for f in range(self._nf):
             res[f] = res[f][ind]
 
@@ -367,24 +688,31 @@ class MNCVariable(object):
         shape = tuple(np.isscalar(d) and d or d[fn] for d in self.shape)
         res = np.zeros(shape, self.typecode())
         s = [slice(None) for d in self.shape]
-        for i,nc in enumerate(self.nc):
+        recsets = self._splitrecs()
+        tiles = []
+        for i in range(len(self._fnames)):
             if self._fn[i] == fn:
                 if self._Xdim is not None:
                     s[self._Xdim] = slice(self._i0[i], self._ie[i])
                 if self._Ydim is not None:
                     s[self._Ydim] = slice(self._j0[i], self._je[i])
-                res[tuple(s)] = nc.variables[self._name][:]
+                for iset,resrecs,recs in recsets:
+                    if self.isrec:
+                        s[0] = resrecs
+                    tiles.append((i, res, tuple(s), recs, iset))
+        self._readtiles(tiles)
 
         return res
 
 
-def mnc_files(fpatt, layout=None):
-    return MNC(fpatt, layout)
+def mnc_files(fpatt, layout=None, maxopen=None, workers=None):
+    return MNC(fpatt, layout, maxopen=maxopen, workers=workers)
 
 mnc_files.__doc__ = MNC.__doc__
 
 
-def rdmnc(fpatt, varnames=None, iters=None, slices=Ellipsis, layout=None):
+def rdmnc(fpatt, varnames=None, iters=None, slices=Ellipsis, layout=None,
+          maxopen=None, workers=None):
     '''
     Read one or more variables from an mnc file set.
 
@@ -399,6 +727,12 @@ def rdmnc(fpatt, varnames=None, iters=None, slices=Ellipsis, layout=None):
     slices : tuple of slice objects
         tuple of slices to read from each variable
         (typically given as numpy.s_[...])
+    layout : string
+        global layout, see MNC
+    maxopen : int
+        maximum number of tile files open at a time (see MNC)
+    workers : int
+        number of threads for reading tile files (see MNC)
 
     Returns
     -------
@@ -410,16 +744,16 @@ def rdmnc(fpatt, varnames=None, iters=None, slices=Ellipsis, layout=None):
     >>> S = rdmnc("mnc_*/state.0000000000.*', ['U', 'V'], slices=numpy.s_[..., 10:-10, 10:-10])
     >>> u = S['U']
     >>> v = S['V']
+    >>> S = rdmnc('mnc_*/state.*.t*.nc', ['Temp'], iters=[36000, 72000])
 
     Notes
     -----
-    Can currently read only one file set (i.e., 1 file per tile),
-    not several files split in time.
+    fpatt may match several file sets split in time (see MNC); only the
+    files holding the requested iterations are read.
 
     Consider using mnc_files for more control (and similar convenience).
-    The same restriction about multiple files applies, however.
     '''
-    mnc = MNC(fpatt, layout)
+    mnc = MNC(fpatt, layout, maxopen=maxopen, workers=workers)
     if varnames is None:
         varnames = mnc.variables.keys()
     elif isinstance(varnames, str):
@@ -440,7 +774,11 @@ def rdmnc(fpatt, varnames=None, iters=None, slices=Ellipsis, layout=None):
     for varname in varnames:
         var = mnc.variables[varname]
         if iters is not None and var.dimensions[0] == 'T':
-            res[varname] = np.array([var[(iit,)+slices] for iit in iits])
+            if var.layout == 'faces':
+                res[varname] = np.array([var[(iit,)+slices] for iit in iits])
+            else:
+                # all records in one pass over the tiles
+                res[varname] = var[(iits,)+slices]
         else:
             res[varname] = var[slices]
 
@@ -15,8 +15,7 @@ with NetCDF files.
 from __future__ import division, print_function, absolute_import
 
 # TODO:
-# * properly implement ``_FillValue``.
-# * implement Jeff Whitaker's patch for masked variables.
+# * apply ``_FillValue`` when writing.
 # * fix character variables.
 # * implement PAGESIZE for Python 2.6?
 
@@ -34,6 +33,10 @@ __all__ = ['netcdf_file']
 
 from operator import mul
 from mmap import mmap, ACCESS_READ
+try:
+    from mmap import MADV_SEQUENTIAL, MADV_NORMAL
+except ImportError:
+    pass
 
 import numpy as np
 from numpy.compat import asbytes, asstr
@@ -41,6 +44,7 @@ from numpy import frombuffer, ndarray, dtype, empty, array, asarray
 from numpy import little_endian as LITTLE_ENDIAN
 from functools import reduce
 
+import os
 import sys
 
 PY3 = sys.version_info[0] == 3
@@ -51,12 +55,18 @@ else:
 
 ABSENT = b'\x00\x00\x00\x00\x00\x00\x00\x00'
 ZERO = b'\x00\x00\x00\x00'
+ZERO64 = b'\x00\x00\x00\x00\x00\x00\x00\x00'
 NC_BYTE = b'\x00\x00\x00\x01'
 NC_CHAR = b'\x00\x00\x00\x02'
 NC_SHORT = b'\x00\x00\x00\x03'
 NC_INT = b'\x00\x00\x00\x04'
 NC_FLOAT = b'\x00\x00\x00\x05'
 NC_DOUBLE = b'\x00\x00\x00\x06'
+NC_UBYTE = b'\x00\x00\x00\x07'
+NC_USHORT = b'\x00\x00\x00\x08'
+NC_UINT = b'\x00\x00\x00\x09'
+NC_INT64 = b'\x00\x00\x00\x0a'
+NC_UINT64 = b'\x00\x00\x00\x0b'
 NC_DIMENSION = b'\x00\x00\x00\n'
 NC_VARIABLE = b'\x00\x00\x00\x0b'
 NC_ATTRIBUTE = b'\x00\x00\x00\x0c'
@@ -67,7 +77,13 @@ TYPEMAP = {NC_BYTE: ('b', 1),
             NC_SHORT: ('h', 2),
             NC_INT: ('i', 4),
             NC_FLOAT: ('f', 4),
-            NC_DOUBLE: ('d', 8)}
+            NC_DOUBLE: ('d', 8),
+            # CDF-5 only
+            NC_UBYTE: ('B', 1),
+            NC_USHORT: ('H', 2),
+            NC_UINT: ('I', 4),
+            NC_INT64: ('q', 8),
+            NC_UINT64: ('Q', 8)}
 
 REVERSE = {('b', 1): NC_BYTE,
             ('B', 1): NC_CHAR,
@@ -82,6 +98,80 @@ REVERSE = {('b', 1): NC_BYTE,
             ('l', 4): NC_INT,
             ('S', 1): NC_CHAR}
 
+# types for CDF-5 (64-bit data format), which has unsigned and 64-bit types
+REVERSE64 = dict(REVERSE)
+REVERSE64.update({('B', 1): NC_UBYTE,
+                  ('H', 2): NC_USHORT,
+                  ('I', 4): NC_UINT,
+                  ('L', 4): NC_UINT,
+                  ('l', 8): NC_INT64,
+                  ('q', 8): NC_INT64,
+                  ('L', 8): NC_UINT64,
+                  ('Q', 8): NC_UINT64})
+
+
+class unmapped_array(object):
+    """ placeholder for the data of variables of header-only files """
+    def __init__(self, shape, dtype_):
+        self.shape = shape
+        self.dtype = dtype(dtype_)
+
+    @property
+    def itemsize(self):
+        return self.dtype.itemsize
+
+    @property
+    def size(self):
+        return reduce(mul, self.shape, 1)
+
+    @property
+    def nbytes(self):
+        return self.size * self.itemsize
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, indx):
+        raise RuntimeError('netcdf_file: opened with header_only, data not available')
+
+    def __setitem__(self, indx, val):
+        raise RuntimeError('netcdf_file: opened with header_only, data not available')
+
+
+# parsed headers of files opened with header_only, by (path, mtime, size)
+_header_cache = {}
+
+# number of headers after which the cache is cleared
+header_cache_size = 10000
+
+# default number of bytes read at a time by netcdf_file.read_records
+read_records_chunksize = 2**26
+
+# approximate number of bytes of records written at a time
+_write_chunksize = 2**26
+
+
+def _copy_attributes(attributes):
+    """ copy of an attribute dict that shares no arrays with it """
+    return dict((k, v.copy() if isinstance(v, ndarray) else v)
+                for k, v in attributes.items())
+
+
+def _record_view(buf, offset, nrecs, recshape, dtype_, recsize):
+    """ array view of nrecs records of a variable in buf, recsize bytes apart """
+    size = dtype(dtype_).itemsize
+    strides = ()
+    for n in recshape[::-1]:
+        strides = (size,) + strides
+        size *= n
+    return ndarray.__new__(ndarray, (nrecs,) + tuple(recshape), dtype=dtype_,
+                           buffer=buf, offset=offset,
+                           strides=(recsize,) + strides)
+
 
 class netcdf_file(object):
     """
@@ -107,11 +197,20 @@ class netcdf_file(object):
         Whether to mmap `filename` when reading.  Default is True
         when `filename` is a file name, False when `filename` is a
         file-like object
-    version : {1, 2}, optional
+    version : {1, 2, 5}, optional
         version of netcdf to read / write, where 1 means *Classic
-        format* and 2 means *64-bit offset format*.  Default is 1.  See
+        format*, 2 means *64-bit offset format* and 5 means *64-bit data
+        format* (CDF-5, which also has unsigned and 64-bit integer types).
+        Default is 1.  When reading, the version is taken from the file.  See
         `here <http://www.unidata.ucar.edu/software/netcdf/docs/netcdf/Which-Format.html>`_
         for more info.
+    header_only : bool, optional
+        If True (mode 'r' only), read only dimensions, attributes and
+        variable meta data.  Variable data are not mapped or read and
+        raise an error when accessed.  Headers of files given by name are
+        cached for the process (keyed by path, modification time and
+        size), so opening the same unchanged file again does not read it.
+        Default is False.
 
     Notes
     -----
@@ -189,10 +288,29 @@ class netcdf_file(object):
         >>>     print(f.history)
         Created for a test
     """
-    def __init__(self, filename, mode='r', mmap=None, version=1):
+    def __init__(self, filename, mode='r', mmap=None, version=1,
+                 header_only=False):
         """Initialize netcdf_file from fileobj (str or file-like)."""
+        if header_only and mode != 'r':
+            raise ValueError("header_only requires mode 'r'.")
+        self.header_only = header_only
+        cachekey = None
+        if header_only and not hasattr(filename, 'seek'):
+            st = os.stat(filename)
+            cachekey = (os.path.abspath(filename), st.st_mtime, st.st_size)
+            header = _header_cache.get(cachekey)
+            if header is not None:
+                self.filename = filename
+                self.fp = None
+                self.use_mmap = False
+                self._fds = []
+                self.mode = mode
+                self._set_header(header)
+                return
+
         if hasattr(filename, 'seek'):  # file-like
             self.fp = filename
+            self._own_fp = False
             self.filename = 'None'
             if mmap is None:
                 mmap = False
@@ -201,10 +319,13 @@ class netcdf_file(object):
         else:  # maybe it's a string
             self.filename = filename
             self.fp = open(self.filename, '%sb' % mode)
+            self._own_fp = True
             if mmap is None:
                 mmap = True
         self.use_mmap = mmap
         self._fds = []
+        if not version in (1, 2, 5):
+            raise ValueError("Version must be 1, 2 or 5.")
         self.version_byte = version
 
         if not mode in 'rw':
@@ -222,6 +343,39 @@ class netcdf_file(object):
 
         if mode == 'r':
             self._read()
+            if cachekey is not None:
+                if len(_header_cache) >= header_cache_size:
+                    _header_cache.clear()
+                _header_cache[cachekey] = self._get_header()
+
+    def _get_header(self):
+        """ return parsed header of a header_only file (for the cache) """
+        variables = [(name, var._typecode, var._size, var._shape, var.data.shape,
+                      var.data.dtype, var.dimensions,
+                      _copy_attributes(var._attributes))
+                     for name, var in self.variables.items()]
+        return (self.version_byte, self._recs, self._recsize,
+                dict(self.dimensions), list(self._dims),
+                _copy_attributes(self._attributes), variables)
+
+    def _set_header(self, header):
+        """ set up header_only file from cached header """
+        (version_byte, recs, recsize, dimensions, dims, attributes,
+         variables) = header
+        self.version_byte = version_byte
+        self._recs = recs
+        self._recsize = recsize
+        self.dimensions = dict(dimensions)
+        self._dims = list(dims)
+        self.__dict__['_attributes'] = {}
+        for k, v in _copy_attributes(attributes).items():
+            self.__setattr__(k, v)
+        self.__dict__['variables'] = {}
+        for (name, typecode, size, shape, datashape, dtype_, dimensions_,
+             attributes) in variables:
+            self.variables[name] = netcdf_variable(
+                    unmapped_array(datashape, dtype_), typecode, size, shape,
+                    dimensions_, _copy_attributes(attributes))
 
     def __setattr__(self, attr, value):
         # Store user defined attributes in a separate dict,
@@ -239,7 +393,7 @@ class netcdf_file(object):
             for mmap_fd in self._fds:
                 mmap_fd.close()
         finally:
-            if not self.fp.closed:
+            if self.fp is not None and not self.fp.closed:
                 try:
                     self.flush()
                 finally:
@@ -252,6 +406,65 @@ class netcdf_file(object):
     def __exit__(self, type, value, traceback):
         self.close()
 
+    def read_records(self, names=None, start=0, stop=None, chunksize=None):
+        """
+        Read several record variables over a range of records in one pass.
+
+        Records of all record variables are interleaved in the file, so
+        reading the variables one after the other passes over the record
+        block once per variable.  This method instead reads chunks of
+        consecutive records and copies each variable's part of them into
+        its own contiguous array, passing over the file only once.
+
+        Parameters
+        ----------
+        names : list of str, optional
+            record variables to read; default all
+        start, stop : int, optional
+            range of records to read, as in ``slice(start, stop)``
+        chunksize : int, optional
+            approximate number of bytes of the file to read at a time;
+            default `read_records_chunksize`
+
+        Returns
+        -------
+        data : dict
+            maps each name to an array of shape ``(nrec,) + shape[1:]``
+        """
+        if self.header_only:
+            raise RuntimeError('Cannot read data of a header_only file.')
+        if names is None:
+            names = [k for k, v in self.variables.items() if v.isrec]
+        for name in names:
+            if not self.variables[name].isrec:
+                raise ValueError('%s is not a record variable' % name)
+        if chunksize is None:
+            chunksize = read_records_chunksize
+
+        start, stop, _ = slice(start, stop).indices(self._recs)
+        stop = max(start, stop)
+        data = {}
+        for name in names:
+            var = self.variables[name].data
+            data[name] = empty((stop - start,) + var.shape[1:], var.dtype)
+
+        # hint the kernel to read ahead (python >= 3.8)
+        mm = None
+        if self.use_mmap and self._fds and hasattr(self._fds[0], 'madvise'):
+            mm = self._fds[0]
+            mm.madvise(MADV_SEQUENTIAL)
+        try:
+            step = max(1, chunksize // max(1, self._recsize))
+            for rec0 in range(start, stop, step):
+                rec1 = min(rec0 + step, stop)
+                for name in names:
+                    data[name][rec0-start:rec1-start] = \
+                            self.variables[name].data[rec0:rec1]
+        finally:
+            if mm is not None:
+                mm.madvise(MADV_NORMAL)
+        return data
+
     def createDimension(self, name, length):
         """
         Adds a dimension to the Dimension section of the NetCDF data structure.
@@ -311,8 +524,9 @@ class netcdf_file(object):
 
         type = dtype(type)
         typecode, size = type.char, type.itemsize
-        if (typecode, size) not in REVERSE:
-            raise ValueError("NetCDF 3 does not support type %s" % type)
+        if (typecode, size) not in self._reverse():
+            raise ValueError("NetCDF version %d does not support type %s"
+                             % (self.version_byte, type))
 
         data = empty(shape_, dtype=type.newbyteorder("B"))  # convert to big endian always for NetCDF 3
         self.variables[name] = netcdf_variable(data, typecode, size, shape, dimensions)
@@ -334,7 +548,7 @@ class netcdf_file(object):
     def _write(self):
         self.fp.seek(0)
         self.fp.write(b'CDF')
-        self.fp.write(array(self.version_byte, '>b').tostring())
+        self.fp.write(array(self.version_byte, '>b').tobytes())
 
         # Write headers and data.
         self._write_numrecs()
@@ -347,18 +561,18 @@ class netcdf_file(object):
         for var in self.variables.values():
             if var.isrec and len(var.data) > self._recs:
                 self.__dict__['_recs'] = len(var.data)
-        self._pack_int(self._recs)
+        self._pack_nonneg(self._recs)
 
     def _write_dim_array(self):
         if self.dimensions:
             self.fp.write(NC_DIMENSION)
-            self._pack_int(len(self.dimensions))
+            self._pack_nonneg(len(self.dimensions))
             for name in self._dims:
                 self._pack_string(name)
                 length = self.dimensions[name]
-                self._pack_int(length or 0)  # replace None with 0 for record dimension
+                self._pack_nonneg(length or 0)  # replace None with 0 for record dimension
         else:
-            self.fp.write(ABSENT)
+            self._write_absent()
 
     def _write_gatt_array(self):
         self._write_att_array(self._attributes)
@@ -366,17 +580,17 @@ class netcdf_file(object):
     def _write_att_array(self, attributes):
         if attributes:
             self.fp.write(NC_ATTRIBUTE)
-            self._pack_int(len(attributes))
+            self._pack_nonneg(len(attributes))
             for name, values in attributes.items():
                 self._pack_string(name)
                 self._write_values(values)
         else:
-            self.fp.write(ABSENT)
+            self._write_absent()
 
     def _write_var_array(self):
         if self.variables:
             self.fp.write(NC_VARIABLE)
-            self._pack_int(len(self.variables))
+            self._pack_nonneg(len(self.variables))
 
             # Sort variables non-recs first, then recs. We use a DSU
             # since some people use pupynere with Python 2.3.x.
@@ -392,24 +606,27 @@ class netcdf_file(object):
             self.__dict__['_recsize'] = sum([
                     var._vsize for var in self.variables.values()
                     if var.isrec])
-            # Set the data for all variables.
+            # Set the data for all variables, record variables last.
             for name in variables:
-                self._write_var_data(name)
+                if not self.variables[name].isrec:
+                    self._write_var_data(name)
+            self._write_rec_data([name for name in variables
+                                  if self.variables[name].isrec])
         else:
-            self.fp.write(ABSENT)
+            self._write_absent()
 
     def _write_var_metadata(self, name):
         var = self.variables[name]
 
         self._pack_string(name)
-        self._pack_int(len(var.dimensions))
+        self._pack_nonneg(len(var.dimensions))
         for dimname in var.dimensions:
             dimid = self._dims.index(dimname)
-            self._pack_int(dimid)
+            self._pack_nonneg(dimid)
 
         self._write_att_array(var._attributes)
 
-        nc_type = REVERSE[var.typecode(), var.itemsize()]
+        nc_type = self._reverse()[var.typecode(), var.itemsize()]
         self.fp.write(asbytes(nc_type))
 
         if not var.isrec:
@@ -425,7 +642,7 @@ class netcdf_file(object):
             if rec_vars > 1:
                 vsize += -vsize % 4
         self.variables[name].__dict__['_vsize'] = vsize
-        self._pack_int(vsize)
+        self._pack_nonneg(vsize)
 
         # Pack a bogus begin, and set the real value later.
         self.variables[name].__dict__['_begin'] = self.fp.tell()
@@ -440,36 +657,55 @@ class netcdf_file(object):
         self._pack_begin(the_beguine)
         self.fp.seek(the_beguine)
 
-        # Write data.
-        if not var.isrec:
-            self.fp.write(var.data.tostring())
-            count = var.data.size * var.data.itemsize
-            self.fp.write(b'0' * (var._vsize - count))
-        else:  # record variable
+        # Write data (through the buffer interface, without copying).
+        data = var.data
+        # Apparently scalars cannot be converted to big endian. If we
+        # try to convert a ``=i4`` scalar to, say, '>i4' the dtype
+        # will remain as ``=i4``.
+        if not data.shape and (data.dtype.byteorder == '<' or
+                (data.dtype.byteorder == '=' and LITTLE_ENDIAN)):
+            data = data.byteswap()
+        self.fp.write(memoryview(data))
+        count = data.size * data.itemsize
+        self.fp.write(b'\x00' * (var._vsize - count))
+
+    def _write_rec_data(self, names):
+        """ write data of record variables, a block of records at a time """
+        pos0 = self.fp.tell()
+        offsets = []
+        offset = 0
+        for name in names:
+            var = self.variables[name]
             # Handle rec vars with shape[0] < nrecs.
             if self._recs > len(var.data):
                 shape = (self._recs,) + var.data.shape[1:]
                 var.data.resize(shape)
-
-            pos0 = pos = self.fp.tell()
-            for rec in var.data:
-                # Apparently scalars cannot be converted to big endian. If we
-                # try to convert a ``=i4`` scalar to, say, '>i4' the dtype
-                # will remain as ``=i4``.
-                if not rec.shape and (rec.dtype.byteorder == '<' or
-                        (rec.dtype.byteorder == '=' and LITTLE_ENDIAN)):
-                    rec = rec.byteswap()
-                self.fp.write(rec.tostring())
-                # Padding
-                count = rec.size * rec.itemsize
-                self.fp.write(b'0' * (var._vsize - count))
-                pos += self._recsize
-                self.fp.seek(pos)
-            self.fp.seek(pos0 + var._vsize)
+            # Set begin in file header.
+            self.fp.seek(var._begin)
+            self._pack_begin(pos0 + offset)
+            offsets.append(offset)
+            offset += var._vsize
+        self.fp.seek(pos0)
+
+        if not self._recs or not self._recsize:
+            return
+
+        # Assemble blocks of records (with zero padding) in a buffer and
+        # write each block at once.
+        nrecs = max(1, min(self._recs, _write_chunksize // self._recsize))
+        buf = np.zeros(nrecs*self._recsize, 'B')
+        for rec0 in range(0, self._recs, nrecs):
+            n = min(nrecs, self._recs - rec0)
+            for name, offset in zip(names, offsets):
+                data = self.variables[name].data
+                out = _record_view(buf, offset, n, data.shape[1:],
+                                   data.dtype.newbyteorder('>'), self._recsize)
+                out[...] = data[rec0:rec0+n]
+            self.fp.write(memoryview(buf)[:n*self._recsize])
 
     def _write_values(self, values):
         if hasattr(values, 'dtype'):
-            nc_type = REVERSE[values.dtype.char, values.dtype.itemsize]
+            nc_type = self._reverse()[values.dtype.char, values.dtype.itemsize]
         else:
             types = [(t, NC_INT) for t in integer_types]
             types += [
@@ -500,14 +736,14 @@ class netcdf_file(object):
             nelems = values.itemsize
         else:
             nelems = values.size
-        self._pack_int(nelems)
+        self._pack_nonneg(nelems)
 
         if not values.shape and (values.dtype.byteorder == '<' or
                 (values.dtype.byteorder == '=' and LITTLE_ENDIAN)):
             values = values.byteswap()
-        self.fp.write(values.tostring())
+        self.fp.write(values.tobytes())
         count = values.size * values.itemsize
-        self.fp.write(b'0' * (-count % 4))  # pad
+        self.fp.write(b'\x00' * (-count % 4))  # pad
 
     def _read(self):
         # Check magic bytes and version
@@ -515,7 +751,10 @@ class netcdf_file(object):
         if not magic == b'CDF':
             raise TypeError("Error: %s is not a valid NetCDF 3 file" %
                             self.filename)
-        self.__dict__['version_byte'] = frombuffer(self.fp.read(1), '>b')[0]
+        self.__dict__['version_byte'] = int(frombuffer(self.fp.read(1), '>b')[0])
+        if not self.version_byte in (1, 2, 5):
+            raise TypeError("Error: %s has unsupported NetCDF version %d" %
+                            (self.filename, self.version_byte))
 
         # Read file headers and set data.
         self._read_numrecs()
@@ -524,17 +763,17 @@ class netcdf_file(object):
         self._read_var_array()
 
     def _read_numrecs(self):
-        self.__dict__['_recs'] = self._unpack_int()
+        self.__dict__['_recs'] = self._unpack_nonneg()
 
     def _read_dim_array(self):
         header = self.fp.read(4)
         if not header in [ZERO, NC_DIMENSION]:
             raise ValueError("Unexpected header.")
-        count = self._unpack_int()
+        count = self._unpack_nonneg()
 
         for dim in range(count):
             name = asstr(self._unpack_string())
-            length = self._unpack_int() or None  # None for record dimension
+            length = self._unpack_nonneg() or None  # None for record dimension
             self.dimensions[name] = length
             self._dims.append(name)  # preserve order
 
@@ -546,7 +785,7 @@ class netcdf_file(object):
         header = self.fp.read(4)
         if not header in [ZERO, NC_ATTRIBUTE]:
             raise ValueError("Unexpected header.")
-        count = self._unpack_int()
+        count = self._unpack_nonneg()
 
         attributes = {}
         for attr in range(count):
@@ -559,14 +798,9 @@ class netcdf_file(object):
         if not header in [ZERO, NC_VARIABLE]:
             raise ValueError("Unexpected header.")
 
-        nrsize = 0
-        nrbegin = 0
-        recbegin = 0
-        nrdtype = {'names': [], 'formats': []}
-        recdtype = {'names': [], 'formats': []}
-        nr_vars = []
+        recbegin = None
         rec_vars = []
-        count = self._unpack_int()
+        count = self._unpack_nonneg()
         for var in range(count):
             (name, dimensions, shape, attributes,
              typecode, size, dtype_, begin_, vsize) = self._read_var()
@@ -584,44 +818,39 @@ class netcdf_file(object):
             # 32-bit vsize field is not large enough to contain the size
             # of variables that require more than 2^32 - 4 bytes, so
             # 2^32 - 1 is used in the vsize field for such variables.
-            isrec = shape and shape[0] is None  # record variable
+            isrec = bool(shape) and shape[0] is None  # record variable
             recshape = shape[isrec:]  # shape without record dimension
 
-            # construct dtype
-            names = [name]
-            formats = [str(recshape) + dtype_]
-            # Handle padding with a virtual variable.
-            if typecode in 'bch':
-                actual_size = reduce(mul, recshape, 1) * size
-                padding = -actual_size % 4
-                if padding:
-                    names.append('_padding_%d' % var)
-                    formats.append('(%d,)>b' % padding)
-
             if isrec:
-                rec_vars.append(name)
+                # Calculate size to avoid problems with vsize (above)
+                actual_size = reduce(mul, recshape, 1) * size
+                rec_vars.append((name, recshape, dtype_, size, begin_,
+                                 actual_size))
                 # The netCDF "record size" is calculated as the sum of
                 # the vsize's of all the record variables.
                 self.__dict__['_recsize'] += vsize
-                if recbegin == 0:
+                if recbegin is None:
                     recbegin = begin_
-                recdtype['names'].extend(names)
-                recdtype['formats'].extend(formats)
 
-                # Data will be set later.
-                data = None
+                if self.header_only:
+                    data = unmapped_array((self._recs,) + recshape, dtype_)
+                else:
+                    # Data will be set later.
+                    data = None
             else:  # not a record variable
-                nr_vars.append(name)
-                nrsize += vsize
-                if nrbegin == 0:
-                    nrbegin = begin_
-                nrdtype['names'].extend(names)
-                nrdtype['formats'].extend(formats)
-
                 # Calculate size to avoid problems with vsize (above)
                 a_size = reduce(mul, shape, 1) * size
-                if self.use_mmap:
-                    data = None
+                if self.header_only:
+                    data = unmapped_array(shape, dtype_)
+                elif self.use_mmap:
+                    # map variables one by one rather than through a
+                    # structured dtype, whose itemsize would be limited
+                    # to 2**31 bytes
+                    if not self._fds:
+                        self._fds.append(mmap(self.fp.fileno(), 0,
+                                              access=ACCESS_READ))
+                    data = ndarray.__new__(ndarray, shape, dtype=dtype_,
+                            buffer=self._fds[0], offset=begin_, order='C')
                 else:
                     pos = self.fp.tell()
                     self.fp.seek(begin_)
@@ -633,36 +862,36 @@ class netcdf_file(object):
             self.variables[name] = netcdf_variable(
                     data, typecode, size, shape, dimensions, attributes)
 
-        if self.use_mmap:
-            # Build nonrec array.
-            mm = mmap(self.fp.fileno(), nrbegin+nrsize, access=ACCESS_READ)
-            nr_array = ndarray.__new__(ndarray, (), dtype=nrdtype, buffer=mm,
-                    offset=nrbegin, order='C')
-            self._fds.append(mm)
-            for var in nr_vars:
-                self.variables[var].__dict__['data'] = nr_array[var]
+        if self.header_only:
+            # done with the file; leave file objects of the caller open
+            if self._own_fp:
+                self.fp.close()
+            self.__dict__['fp'] = None
+            return
 
         if rec_vars:
-            # Remove padding when only one record variable.
+            # No padding when only one record variable.
             if len(rec_vars) == 1:
-                recdtype['names'] = recdtype['names'][:1]
-                recdtype['formats'] = recdtype['formats'][:1]
+                self.__dict__['_recsize'] = rec_vars[0][-1]
 
-            # Build rec array.
+            # Build record arrays as strided views of the record block.
             if self.use_mmap:
-                mm = mmap(self.fp.fileno(), recbegin+self._recs*self._recsize, access=ACCESS_READ)
-                rec_array = ndarray.__new__(ndarray, (self._recs,), dtype=recdtype,
-                        buffer=mm, offset=recbegin, order='C')
-                self._fds.append(mm)
+                if not self._fds:
+                    self._fds.append(mmap(self.fp.fileno(), 0,
+                                          access=ACCESS_READ))
+                buf = self._fds[0]
+                offset = 0
             else:
                 pos = self.fp.tell()
                 self.fp.seek(recbegin)
-                rec_array = frombuffer(self.fp.read(self._recs*self._recsize), dtype=recdtype)
-                rec_array.shape = (self._recs,)
+                buf = self.fp.read(self._recs*self._recsize)
                 self.fp.seek(pos)
+                offset = recbegin
 
-            for var in rec_vars:
-                self.variables[var].__dict__['data'] = rec_array[var]
+            for name, recshape, dtype_, size, begin_, _ in rec_vars:
+                self.variables[name].__dict__['data'] = _record_view(
+                        buf, begin_ - offset, self._recs, recshape, dtype_,
+                        self._recsize)
 
         # further reading will be done through the mmaps
         self.fp.close()
@@ -671,10 +900,10 @@ class netcdf_file(object):
         name = asstr(self._unpack_string())
         dimensions = []
         shape = []
-        dims = self._unpack_int()
+        dims = self._unpack_nonneg()
 
         for i in range(dims):
-            dimid = self._unpack_int()
+            dimid = self._unpack_nonneg()
             dimname = self._dims[dimid]
             dimensions.append(dimname)
             dim = self.dimensions[dimname]
@@ -684,8 +913,11 @@ class netcdf_file(object):
 
         attributes = self._read_att_array()
         nc_type = self.fp.read(4)
-        vsize = self._unpack_int()
-        begin = [self._unpack_int, self._unpack_int64][self.version_byte-1]()
+        vsize = self._unpack_nonneg()
+        if self.version_byte == 1:
+            begin = self._unpack_int()
+        else:
+            begin = self._unpack_int64()
 
         typecode, size = TYPEMAP[nc_type]
         dtype_ = '>%s' % typecode
@@ -694,7 +926,7 @@ class netcdf_file(object):
 
     def _read_values(self):
         nc_type = self.fp.read(4)
-        n = self._unpack_int()
+        n = self._unpack_nonneg()
 
         typecode, size = TYPEMAP[nc_type]
 
@@ -710,14 +942,38 @@ class netcdf_file(object):
             values = values.rstrip(b'\x00')
         return values
 
+    def _reverse(self):
+        """ map from (typecode, size) to NetCDF type for this version """
+        if self.version_byte == 5:
+            return REVERSE64
+        else:
+            return REVERSE
+
+    def _write_absent(self):
+        self.fp.write(ZERO)
+        self._pack_nonneg(0)
+
     def _pack_begin(self, begin):
         if self.version_byte == 1:
             self._pack_int(begin)
-        elif self.version_byte == 2:
+        else:
             self._pack_int64(begin)
 
+    # counts and lengths (NON_NEG) are 64 bits in CDF-5, 32 bits otherwise
+    def _pack_nonneg(self, value):
+        if self.version_byte == 5:
+            self._pack_int64(value)
+        else:
+            self._pack_int(value)
+
+    def _unpack_nonneg(self):
+        if self.version_byte == 5:
+            return int(self._unpack_int64())
+        else:
+            return self._unpack_int()
+
     def _pack_int(self, value):
-        self.fp.write(array(value, '>i').tostring())
+        self.fp.write(array(value, '>i').tobytes())
     _pack_int32 = _pack_int
 
     def _unpack_int(self):
@@ -725,19 +981,19 @@ class netcdf_file(object):
     _unpack_int32 = _unpack_int
 
     def _pack_int64(self, value):
-        self.fp.write(array(value, '>q').tostring())
+        self.fp.write(array(value, '>q').tobytes())
 
     def _unpack_int64(self):
         return frombuffer(self.fp.read(8), '>q')[0]
 
     def _pack_string(self, s):
         count = len(s)
-        self._pack_int(count)
+        self._pack_nonneg(count)
         self.fp.write(asbytes(s))
-        self.fp.write(b'0' * (-count % 4))  # pad
+        self.fp.write(b'\x00' * (-count % 4))  # pad
 
     def _unpack_string(self):
-        count = self._unpack_int()
+        count = self._unpack_nonneg()
         s = self.fp.read(count).rstrip(b'\x00')
         self.fp.read(-count % 4)  # read padding
         return s
@@ -898,6 +1154,92 @@ class netcdf_variable(object):
         """
         return self._size
 
+    def decode(self, index=Ellipsis, out=None, dtype=None, fill=np.nan):
+        """
+        Return (a subset of) the data unpacked and with missing values filled.
+
+        Points equal to the ``_FillValue`` or ``missing_value`` attributes
+        are replaced by `fill`, and the data are unpacked as
+        ``data*scale_factor + add_offset`` if these attributes are present.
+        The data are converted once into the result, which is then modified
+        in place.
+
+        Parameters
+        ----------
+        index : index, optional
+            subset of the data to decode, as for indexing; default all
+        out : array, optional
+            array of the shape of the subset to store the result in; its
+            type is used for the result
+        dtype : dtype, optional
+            type of the result if `out` is not given, e.g. np.float32.
+            Default is the type of scale_factor or add_offset if present,
+            else the type of the variable if floating point, else float64.
+        fill : scalar or None, optional
+            value for missing points, default NaN.  If None, return a
+            masked array instead.  An integer result needs an integer
+            `fill` or None if the variable has missing values.
+
+        Returns
+        -------
+        data : array or masked array
+            the decoded data (`out` if given)
+        """
+        raw = self.data[index]
+        scale = self._attributes.get('scale_factor')
+        offset = self._attributes.get('add_offset')
+
+        # find missing points in the packed data
+        mask = None
+        for att in ['_FillValue', 'missing_value']:
+            for value in np.atleast_1d(self._attributes.get(att, [])):
+                if value != value:
+                    # NaN never compares equal
+                    if raw.dtype.kind not in 'fc':
+                        continue
+                    ismissing = np.isnan(raw)
+                else:
+                    ismissing = raw == value
+                if mask is None:
+                    mask = ismissing
+                else:
+                    mask |= ismissing
+
+        if out is None:
+            if dtype is None:
+                packing = [a for a in [scale, offset] if a is not None]
+                if packing:
+                    dtype = np.result_type(*packing)
+                elif raw.dtype.kind in 'fc':
+                    dtype = raw.dtype.newbyteorder('=')
+                else:
+                    dtype = np.float64
+            out = empty(raw.shape, dtype)
+        if (mask is not None and fill is not None and out.dtype.kind not in 'fc'
+                and fill != fill):
+            raise ValueError('Cannot fill missing values of {} result with NaN, '
+                             'pass fill (or fill=None)'.format(out.dtype))
+        if out.dtype.kind in 'fc' or (scale is None and offset is None):
+            out[...] = raw
+            if scale is not None:
+                out *= scale
+            if offset is not None:
+                out += offset
+        else:
+            # unpack in floating point before converting to an integer result
+            tmp = raw*scale if scale is not None else raw.astype(np.float64)
+            if offset is not None:
+                tmp += offset
+            out[...] = tmp
+
+        if fill is None:
+            if mask is None:
+                mask = np.ma.nomask
+            return np.ma.masked_array(out, mask=mask, copy=False)
+        if mask is not None:
+            out[mask] = fill
+        return out
+
     def __getitem__(self, index):
         return self.data[index]
 
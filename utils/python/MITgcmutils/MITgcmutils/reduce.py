@@ -0,0 +1,191 @@
+import numpy as np
+from .mds import iter_rdmds, _aslist
+
+class RunningStats(object):
+    """
+    Running mean, variance, minimum, maximum and histogram of a sequence of
+    arrays of equal shape, computed one array at a time.
+
+    The mean and variance are updated with Welford's algorithm, which is
+    numerically stable also for long sequences and large means.  Memory use
+    is a few arrays of the shape of one sample, independent of the number of
+    samples.
+
+    Parameters
+    ----------
+    bins : int or sequence of scalars or None
+        if given, also count a histogram of all values (of all points) with
+        these bins, like numpy.histogram.  An integer number of bins needs
+        `binrange`.
+    binrange : (float, float) or None
+        lower and upper range of the bins if bins is an integer
+
+    Attributes
+    ----------
+    count : int
+        number of samples
+    mean : array
+        mean of the samples
+    min, max : array
+        minimum and maximum of the samples
+    hist : array of int
+        histogram counts (if bins were given)
+    bin_edges : array
+        bin edges of the histogram (if bins were given)
+
+    Examples
+    --------
+    >>> s = RunningStats()
+    >>> for it,T,meta in iter_rdmds('T'):
+    ...     s.update(T)
+    >>> Tmean, Tstd = s.mean, s.std()
+    """
+    def __init__(self, bins=None, binrange=None):
+        self.count = 0
+        self.mean = None
+        self.min = None
+        self.max = None
+        self._m2 = None
+        # work arrays for update, allocated with the first update that needs them
+        self._delta = None
+        self._tmp = None
+        if bins is None:
+            self.bin_edges = None
+            self.hist = None
+        else:
+            if np.ndim(bins) == 0:
+                if binrange is None:
+                    raise ValueError('Need binrange for an integer number of bins')
+                bins = np.linspace(binrange[0], binrange[1], bins + 1)
+            self.bin_edges = np.asarray(bins, float)
+            self.hist = np.zeros(len(self.bin_edges) - 1, int)
+
+    def update(self, a):
+        """ add array a to the statistics """
+        a = np.asarray(a)
+        if self.hist is not None:
+            self.hist += np.histogram(a, self.bin_edges)[0]
+        self.count += 1
+        if self.mean is None:
+            self.mean = a.astype(float)
+            self._m2 = np.zeros(a.shape)
+            self.min = a.copy()
+            self.max = a.copy()
+        else:
+            if a.shape != self.mean.shape:
+                raise ValueError('Shape mismatch: {} vs {}'.format(a.shape,
+                                                                   self.mean.shape))
+            np.minimum(self.min, a, out=self.min)
+            np.maximum(self.max, a, out=self.max)
+            if self._delta is None:
+                self._delta = np.empty(self.mean.shape)
+                self._tmp = np.empty(self.mean.shape)
+            delta = np.subtract(a, self.mean, out=self._delta)
+            tmp = np.divide(delta, self.count, out=self._tmp)
+            self.mean += tmp
+            # m2 += delta*(a - new mean), in the work arrays
+            np.subtract(a, self.mean, out=tmp)
+            delta *= tmp
+            self._m2 += delta
+
+    def merge(self, other):
+        """ add the statistics of other (another RunningStats) to these """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean.copy()
+            self._m2 = other._m2.copy()
+            self.min = other.min.copy()
+            self.max = other.max.copy()
+        else:
+            n = self.count + other.count
+            delta = other.mean - self.mean
+            self._m2 += other._m2 + delta**2*(self.count*other.count/float(n))
+            self.mean += delta*(other.count/float(n))
+            self.count = n
+            np.minimum(self.min, other.min, out=self.min)
+            np.maximum(self.max, other.max, out=self.max)
+        if self.hist is not None:
+            self.hist += other.hist
+
+    def var(self, ddof=0):
+        """ variance of the samples (divided by count - ddof) """
+        return self._m2/(self.count - ddof)
+
+    def std(self, ddof=0):
+        """ standard deviation of the samples (divided by count - ddof) """
+        return np.sqrt(self.var(ddof))
+
+
+def mdsstats(fnames, itrs=np.nan, rec=None, bins=None, binrange=None,
+             workers=1, prefetch=1, **kwargs):
+    """
+    Compute running statistics over the time levels of one or more mds
+    fields without holding more than a few time levels in memory.
+
+    Each field is read one iteration at a time with :func:`iter_rdmds` and
+    the statistics of each record are updated with :class:`RunningStats`.
+
+    Call signature::
+
+        stats = mdsstats(fnames, itrs, ...)
+
+    Parameters
+    ----------
+    fnames : string or list of strings
+        names of files to read, without iteration number and suffix
+    itrs : list of int or np.NaN
+        iteration numbers; np.NaN (default) for all iterations found
+        (separately for each field)
+    rec : int or list of int or None
+        records to compute statistics for (default all); useful for
+        multi-field diagnostics files
+    bins, binrange :
+        histogram bins, see :class:`RunningStats`
+    workers : int
+        number of fields processed concurrently, in threads (default 1)
+    prefetch : int
+        number of iterations to read ahead for each field (see iter_rdmds)
+    kwargs
+        passed to rdmds (e.g. lev, region, astype)
+
+    Returns
+    -------
+    stats : dict
+        maps each file name to a list of :class:`RunningStats`, one per
+        record read
+
+    Examples
+    --------
+    >>> stats = mdsstats(['T', 'S'], workers=2)
+    >>> Tmean = stats['T'][0].mean
+    >>> stats = mdsstats('diags', rec=[0,1], bins=np.linspace(-2,30,65))
+    >>> thetahist = stats['diags'][0].hist
+    """
+    if isinstance(fnames, str):
+        fnames = [fnames]
+
+    def reduce1(fname):
+        stats = None
+        for it,a,meta in iter_rdmds(fname, itrs, prefetch, rec=rec, **kwargs):
+            if rec is None:
+                nrec = meta['nrecords'][0]
+            else:
+                nrec = len(_aslist(rec))
+            if nrec == 1:
+                # rdmds has squeezed the record dimension
+                a = a[np.newaxis]
+            if stats is None:
+                stats = [ RunningStats(bins, binrange) for _ in a ]
+            for s,arec in zip(stats, a):
+                s.update(arec)
+            del a
+        return fname, stats
+
+    if workers > 1 and len(fnames) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            return dict(pool.map(reduce1, fnames))
+    else:
+        return dict(reduce1(fname) for fname in fnames)